@@ -1,59 +1,115 @@
 import os
 import time
 import argparse
+import numpy  as np
+import pandas as pd
+from contextlib        import nullcontext
+from concurrent.futures import Future
 from mutual_info       import compute_mi as mi
 from pathlib           import Path
-from configparser      import ConfigParser
 from itertools         import combinations
-from pid_auxiliaries   import compute_and_store_analytical_results
-from brain_data_reader import load_subjet_data, only_useful_data
+from pid_auxiliaries   import compute_and_store_analytical_results, analytical_surrogate_pid
+from surrogates        import CholeskySurrogates
+from significance      import SurrogateSignificance
+from recording         import as_recording
+from pid_metrics       import metrics_run, stage as metrics_stage
+from prefetch          import AsyncWriter, subject_recordings, prefetched, write_csv
+from results_store     import store_results
+from brain_data_reader import load_useful_data, get_file_paths_from_config
+from channels          import left_channels, right_channels
 
-left_channels  = ['EEG Fp1', 'EEG F3', 'EEG F7', 'EEG T3', 'EEG C3', 'EEG T5', 'EEG P3', 'EEG O1', 'EEG Fz', 'EEG Cz', 'EEG Pz']
-right_channels = ['EEG Fp2', 'EEG F4', 'EEG F8', 'EEG T4', 'EEG C4', 'EEG T6', 'EEG P4', 'EEG O2', 'EEG Fz', 'EEG Cz', 'EEG Pz']
 left_triplets  = [list(triplet) for triplet in combinations(left_channels,3)]
 right_triplets = [list(triplet) for triplet in combinations(right_channels,3) if triplet!=('EEG Fz', 'EEG Cz', 'EEG Pz')] #triplet (EEG Fz,EEG Cz,EEG Pz) already in left channels, avoid repeat in right channels
 left_pairs     = list(combinations(left_channels,2))
 right_pairs    = list(combinations(right_channels,2))
 
-def get_file_paths_from_config():
-  current_directory = os.path.dirname(os.path.abspath(__file__))
-  config_file       = Path(current_directory) / 'config.ini'
-  config            = ConfigParser()
-  config.read(config_file)
-  data_path    = config.get('DEFAULT', 'data_path')
-  results_path = config.get('DEFAULT', 'results_path')
-  return data_path,results_path
-
 def str_to_int_list(input_string):
     return [int(item) for item in input_string.split(',')]
 
+def process_subject(ID:int, stageid:str, data_folder:str, results_folder:str, cache_folder:str=None, miestimator:str='ksg',
+                    surrogates:bool=False, samplesize:int=0, seed:int=None, alpha:float=0.05, batch_size:int=1024,
+                    recording:Future=None, writer:AsyncWriter=None, store:str=None) -> int:
+    """
+    Computes and stores the analytical Gaussian PID of all triplets of one subject and stage, ranking the sources with
+    'miestimator' MIs. The results file and store mode end with the estimator, e.g. '_analytical_ksg', so runs with
+    different estimators do not overwrite each other.
+    With 'surrogates', the PID is also computed on 'samplesize' Cholesky surrogates whose sample correlation matrices are
+    drawn directly from their Wishart distribution, and the p-values and FDR masks of the original results against this
+    null are stored (see 'significance.SurrogateSignificance'), without keeping the null draws. The null ranks the sources
+    with the closed-form Gaussian MI of every draw, so the test compares it with original results ranked the same way: with
+    the 'ksg' miestimator these are computed as well and written as a 'gaussian' run would, leaving the KSG-ranked results
+    untouched.
+    Per-stage timings are appended to a '_metrics.jsonl' file next to the results.
+    A prefetched 'recording', an asynchronous 'writer' and a results 'store' are used as in 'PID_binary.process_subject'.
+    The recording is kept in float64 like the data frame it comes from: float32 recordings move the correlations, and so
+    the analytical atoms, by ~1e-5.
+    Returns the number of triplet PIDs computed.
+    """
+    stage            = "rest" if stageid == "1" else "task"
+    data_path_full   = os.path.join(data_folder, "Subject" + str(ID) + "_" + stageid + ".edf")
+    Path(results_folder, stage).mkdir(parents=True, exist_ok=True)
+    result_path      = lambda estimator: os.path.join(results_folder, stage, "Subject" + str(ID) + "_PID_" + stage + "_128Hz_continuous_analytical_" + estimator + ".csv")
+    metrics_path     = os.path.join(results_folder, stage, "Subject" + str(ID) + "_PID_" + stage + "_analytical_metrics.jsonl")
+    with metrics_run(metrics_path, subject=ID, stage=stage, mode='analytical', estimator=miestimator, surrogates=samplesize if surrogates else 0):
+        if recording is None:
+            useful_raw_data = as_recording(load_useful_data(data_path_full,dataset='ari',stage=stage,cache_dir=cache_folder), np.float64)
+        else:
+            useful_raw_data = prefetched(recording)
+        with metrics_stage('mi_ranking', estimator=miestimator):
+            if miestimator == 'ksg':
+                left_MIs     = {frozenset(pair):mi(useful_raw_data[pair[0]],useful_raw_data[pair[1]]) for pair in left_pairs} 
+                right_MIs    = {frozenset(pair):mi(useful_raw_data[pair[0]],useful_raw_data[pair[1]]) for pair in right_pairs} 
+            else:
+                left_MIs     = right_MIs = None
+        results          = {'source1':[],'source2':[],'target' :[],'sinergy':[],'redundancy':[]}
+        with metrics_stage('pid', triplets=len(left_triplets) + len(right_triplets)):
+            compute_and_store_analytical_results(useful_raw_data, left_triplets, right_triplets,left_MIs,right_MIs, results, result_path(miestimator), writer)
+        if store is not None:
+            store_results(store, results, ID, stage, 'analytical_' + miestimator, writer=writer)
+        if surrogates:
+            observed = results
+            if miestimator != 'gaussian':      # the null is ranked with Gaussian MIs, so its original results must be too
+                observed = {key:[] for key in results}
+                with metrics_stage('pid', triplets=len(left_triplets) + len(right_triplets), estimator='gaussian'):
+                    compute_and_store_analytical_results(useful_raw_data, left_triplets, right_triplets, None, None, observed, result_path('gaussian'), writer)
+                if store is not None:
+                    store_results(store, observed, ID, stage, 'analytical_gaussian', writer=writer)
+            cholesky_surrogates = CholeskySurrogates(useful_raw_data, seed=seed)
+            print("Surrogate seed:", cholesky_surrogates.seed)
+            test                = SurrogateSignificance(pd.DataFrame(observed), atoms=('sinergy','redundancy'))
+            with metrics_stage('surrogate_pid', triplets=(len(left_triplets) + len(right_triplets))*samplesize):
+                for null in analytical_surrogate_pid(cholesky_surrogates, left_triplets + right_triplets, samplesize, batch_size=batch_size):
+                    test.update_aligned(np.stack([null['sinergy'], null['redundancy']], axis=-1))
+            Path(results_folder, stage + '_surrogates').mkdir(parents=True, exist_ok=True)
+            write_csv(test.table(alpha), os.path.join(results_folder, stage + '_surrogates', "Subject" + str(ID) + "_PID_" + stage + "_analytical_significance.csv"), writer)
+    return (len(left_triplets) + len(right_triplets))*(1 + (samplesize if surrogates else 0))
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-subjectids', type=str_to_int_list, help='List of integers separated by commas')
     parser.add_argument("-stageid",help='stage of the experiment, can be 1 for rest or 2 for task',choices=["1","2"])
+    parser.add_argument('-cachefolder',default=None,help='folder to cache decoded and resampled recordings, disabled if not given')
+    parser.add_argument("-miestimator",default="ksg",help='mutual information used to rank the sources: KSG estimates or closed-form Gaussian values (surrogates are tested against gaussian-ranked results)',choices=["ksg","gaussian"])
+    parser.add_argument("-surrogates",default="no",help='wether to test the PID against Wishart-sampled Cholesky surrogates',choices=["yes","no"])
+    parser.add_argument("-samplesize",type=int,default=0,help='number of surrogate correlation matrices')
+    parser.add_argument('-seed',      type=int, default=None, help='seed of the surrogate random streams, drawn at random if not given')
+    parser.add_argument('-alpha',     type=float, default=0.05, help='FDR level of the surrogate test')
+    parser.add_argument('-batchsize', type=int, default=1024, help='number of surrogate correlation matrices analysed at once')
+    parser.add_argument('-store',     default=None, help='path of an indexed SQLite results store the results are also written to, disabled if not given')
+    parser.add_argument('-prefetch',  type=int, default=0, help='number of subjects loaded ahead in a background thread while the current one is analysed, with results written in the background, 0 disables it')
     args  = parser.parse_args()
 
     data_folder, rslts_folder =  get_file_paths_from_config()
    
-    Path(rslts_folder+"\\rest").mkdir(exist_ok=True)
-    Path(rslts_folder+"\\task").mkdir(exist_ok=True)
-   
     subject_IDs = args.subjectids
-    stageid     = args.stageid
-    stage       = "rest" if stageid == "1" else "task"
     start = time.time()
-    for ID in subject_IDs:
-        print('\nCurrently processing test subject', str(ID),'...',end='\n\n')
-        data_path_full   = data_folder + "Subject" + str(ID) + "_" + stageid + ".edf"
-        result_path_full = rslts_folder + stage + '\\Subject' + str(ID) + "_PID_" + stage + "_128Hz_continuous_analytical.csv"
-        raw_data         = load_subjet_data(data_path_full)
-        useful_raw_data  = only_useful_data(raw_data,dataset='ari',stage=stage)
-        left_MIs         = {frozenset(pair):mi(useful_raw_data[pair[0]],useful_raw_data[pair[1]]) for pair in left_pairs} 
-        right_MIs        = {frozenset(pair):mi(useful_raw_data[pair[0]],useful_raw_data[pair[1]]) for pair in right_pairs} 
-        results          = {'source1':[],'source2':[],'target' :[],'sinergy':[],'redundancy':[]}
-        compute_and_store_analytical_results(useful_raw_data, left_triplets, right_triplets,left_MIs,right_MIs, results, result_path_full)
-        print('\nFinished!\n\n')
+    with AsyncWriter() if args.prefetch > 0 else nullcontext() as writer:
+        for ID, recording in subject_recordings(subject_IDs, args.stageid, data_folder, args.cachefolder, args.prefetch, np.float64):
+            print('\nCurrently processing test subject', str(ID),'...',end='\n\n')
+            process_subject(ID, args.stageid, data_folder, rslts_folder, args.cachefolder, args.miestimator, args.surrogates == 'yes',
+                            args.samplesize, args.seed, args.alpha, args.batchsize, recording, writer, args.store)
+            print('\nFinished!\n\n')
     end = time.time()
     print("ELAPSED TIME:",(end-start)/60)
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,72 +1,148 @@
+import os
 from pathlib           import Path
-from itertools         import combinations
-from dit_auxiliaries   import pid_row,pid_row_nonbinary,generate_surrogates,symbolize
-from brain_data_reader import load_subjet_data, only_useful_data
+from contextlib        import nullcontext
+from concurrent.futures import Future
+from dit_auxiliaries   import pid_rows,symbolize
+from triplet_scheduler import run_triplets, TripletPool
+from surrogates        import CholeskySurrogates
+from checkpoint        import Checkpoint, run_surrogates_resumably
+from significance      import SequentialSurrogateTest, run_sequential_surrogates
+from result_sink       import ResultSink
+from pid_metrics       import metrics_run, stage as metrics_stage
+from prefetch          import AsyncWriter, subject_recordings, prefetched, write_csv
+from results_store     import store_results
+from recording         import as_recording
+from brain_data_reader import get_file_paths_from_config, load_useful_data
+from channels          import left_triplets, right_triplets
 import argparse
 import pandas as pd
-from tqdm import tqdm
 import time
 
-left_channels  = ['EEG Fp1', 'EEG F3', 'EEG F7', 'EEG T3', 'EEG C3', 'EEG T5', 'EEG P3', 'EEG O1', 'EEG Fz', 'EEG Cz', 'EEG Pz']
-right_channels = ['EEG Fp2', 'EEG F4', 'EEG F8', 'EEG T4', 'EEG C4', 'EEG T6', 'EEG P4', 'EEG O2', 'EEG Fz', 'EEG Cz', 'EEG Pz']
-    
-left_triplets  = [list(triplet) for triplet in combinations(left_channels,3)]
-right_triplets = [list(triplet) for triplet in combinations(right_channels,3)]
+RESULT_KEYS    = ['source1','source2','target','sinergy','unique1','unique2','redundancy']
 
 def str_to_int_list(input_string):
     return [int(item) for item in input_string.split(',')]
 
-def analyze_and_store_results(continuous_data_df:pd.DataFrame, results:dict, path:str)-> None:
-    symbolic_data = symbolize(continuous_data_df,[20,40,60,80])
-    print("done computing PID on LEFT hemisphere...")
+def discretise_data(continuous_data_df:pd.DataFrame) -> pd.DataFrame:
+    with metrics_stage('discretisation'):
+        return symbolize(continuous_data_df,[20,40,60,80])
 
-    for triplet in tqdm(left_triplets):
-       pid_row_nonbinary(symbolic_data, triplet, results)
-    print("done computing PID on RIGHT hemisphere...")
-    
-    for triplet in tqdm(right_triplets):
-       pid_row_nonbinary(symbolic_data, triplet, results)    
-    pd.DataFrame(results).to_csv(path)    
+def analyze_results(continuous_data_df:pd.DataFrame, triplets:list, results:dict, workers:int=1, chunksize:int=165,
+                    pool:TripletPool=None)-> None:
+    run_triplets(pid_rows, discretise_data(continuous_data_df), triplets, results, workers, chunksize, pool)
+
+def analyze_and_store_results(continuous_data_df:pd.DataFrame, results:dict, path:str, workers:int=1, chunksize:int=165,
+                              writer:AsyncWriter=None)-> None:
+    analyze_results(continuous_data_df, left_triplets + right_triplets, results, workers, chunksize)
+    with metrics_stage('csv_write'):
+        write_csv(pd.DataFrame(results), path, writer)
+
+def process_subject(ID:int, stageid:str, data_folder:str, results_folder:str, surrogates:bool=False, samplesize:int=0,
+                    cache_folder:str=None, seed:int=None, workers:int=1, chunksize:int=165, block_size:int=55,
+                    result_format:str='csv', profile_slowest:int=0, sequential:bool=False, alpha:float=0.05,
+                    stop_count:int=None, recording:Future=None, writer:AsyncWriter=None,
+                    store:str=None) -> int:
+    """
+    Computes and stores the PID of all triplets of one subject and stage, on the original data or on Cholesky surrogates.
+    Surrogate runs are checkpointed every 'block_size' triplets and resume from the last completed block when restarted.
+    With result_format 'arrow' all the surrogates are streamed to a single columnar file instead of one CSV per surrogate.
+    Per-stage timings are appended to a '_metrics.jsonl' file next to the results, and with profile_slowest > 0 the slowest
+    triplet chunks are profiled with cProfile (see 'pid_metrics').
+    With 'sequential', surrogates are drawn until the test of every triplet at level 'alpha' is settled (at most 'samplesize',
+    see 'significance.SequentialSurrogateTest') and only the p-values and FDR masks are stored, against the original-data
+    results of the subject (computed first if not stored yet). Sequential runs are not checkpointed.
+    With 'recording' (a Future, see 'prefetch.subject_recordings') the useful data is loaded ahead in a background thread
+    instead of here, and with 'writer' (see 'prefetch.AsyncWriter') the original-data results and sequential tables are
+    written in the background. Checkpointed surrogate results are always written before their block is recorded as done.
+    With 'store' (the path of a 'results_store.ResultsStore') the original-data results are also stored in it.
+    Returns the number of triplet PIDs computed.
+    """
+    stage           = "rest" if stageid == "1" else "task"
+    data_path       = os.path.join(data_folder, "Subject" + str(ID) + "_" + stageid + ".edf")
+    triplets        = left_triplets + right_triplets
+    output_folder   = os.path.join(results_folder, stage + '_surrogates', 'nonbinary') if surrogates else os.path.join(results_folder, stage, 'nonbinary')
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+    metrics_path    = os.path.join(output_folder, "Subject" + str(ID) + "_PID_" + stage + "_nonbinary_metrics.jsonl")
+    with metrics_run(metrics_path, profile_slowest, subject=ID, stage=stage, mode='nonbinary', surrogates=samplesize if surrogates else 0):
+        if recording is None:
+            useful_raw_data = as_recording(load_useful_data(data_path,dataset='ari',stage=stage,cache_dir=cache_folder))
+        else:
+            useful_raw_data = prefetched(recording)
+        if surrogates and sequential:
+            result_path = os.path.join(results_folder, stage, 'nonbinary', "Subject" + str(ID) + "_PID_" + stage + "_128Hz_NonBinary_5symbols.csv")
+            if not os.path.exists(result_path):
+                Path(os.path.dirname(result_path)).mkdir(parents=True, exist_ok=True)
+                analyze_and_store_results(useful_raw_data, {key:[] for key in RESULT_KEYS}, result_path, workers, chunksize)
+            observed            = pd.read_csv(result_path, index_col=0, float_precision='round_trip')
+            test                = SequentialSurrogateTest(observed, samplesize, alpha, stop_count)
+            cholesky_surrogates = CholeskySurrogates(useful_raw_data, seed=seed)
+            print("Surrogate seed:", cholesky_surrogates.seed)
+            with TripletPool(workers) as pool:
+                analyze  = lambda data, block, results: analyze_results(data, block, results, workers, chunksize, pool)
+                computed = run_sequential_surrogates(analyze, cholesky_surrogates, triplets, RESULT_KEYS, test)
+            with metrics_stage('csv_write'):
+                write_csv(test.table(alpha), os.path.join(output_folder, "Subject" + str(ID) + "_PID_" + stage + "_nonbinary_sequential.csv"), writer)
+            return computed
+        elif surrogates:
+            run_name            = "Subject" + str(ID) + "_PID_" + stage + "_nonbinary" + ("_arrow" if result_format == 'arrow' else "")
+            checkpoint          = Checkpoint(os.path.join(output_folder, run_name + "_checkpoint.jsonl"))
+            cholesky_surrogates = CholeskySurrogates(useful_raw_data, seed=checkpoint.resolve_seed(seed))
+            checkpoint.resolve_seed(cholesky_surrogates.seed)   # stores the seed drawn at random on a fresh start
+            print("Surrogate seed:", cholesky_surrogates.seed)
+            surrogates_path     = lambda n: os.path.join(output_folder, "Subject" + str(ID) + "_PID_" + stage + "_surrogate" + str(n) + "_128Hz_NonBinary_5symbols.csv")
+            sink                = None
+            if result_format == 'arrow':
+                sink_path = os.path.join(output_folder, "Subject" + str(ID) + "_PID_" + stage + "_128Hz_NonBinary_5symbols_surrogates.arrow")
+                sink      = ResultSink(sink_path, useful_raw_data.columns, RESULT_KEYS, rows=checkpoint.rows)
+            with TripletPool(workers) as pool:      # discretised once per surrogate, not once per block
+                analyze = lambda data, block, results: run_triplets(pid_rows, data, block, results, workers, chunksize, pool)
+                run_surrogates_resumably(analyze, cholesky_surrogates, samplesize, triplets, RESULT_KEYS, surrogates_path,
+                                         checkpoint, (ID, stage, 'nonbinary'), block_size, sink, discretise_data)
+            if sink is not None:
+                sink.close()
+        else:
+            results       = {key:[] for key in RESULT_KEYS}
+            result_path   = os.path.join(output_folder, "Subject" + str(ID) + "_PID_" + stage + "_128Hz_NonBinary_5symbols.csv")
+            analyze_and_store_results(useful_raw_data, results, result_path, workers, chunksize, writer=writer)
+            if store is not None:
+                store_results(store, results, ID, stage, 'nonbinary', writer=writer)
+    return len(triplets)*samplesize if surrogates else len(triplets)
 
 def main():
+    data_folder, rslts_folder = get_file_paths_from_config()
     parser     = argparse.ArgumentParser()
     parser.add_argument('-subjectids', type=str_to_int_list, help='List of integers separated by commas')
     parser.add_argument("-stageid",help='stage of the experiment, can be 1 for rest or 2 for task',choices=["1","2"])
     parser.add_argument("-surrogates",help='wether to do the PID analysis on original data or on Cholesky surrogates',choices=["yes","no"])    
     parser.add_argument("-samplesize",help='number of surrogate samples')
-    parser.add_argument('-datafolder',    default="G:\\My Drive\\data_research\\NeuNet\\PID_Arithmetic\\data\\", help='path of raw data')
-    parser.add_argument('-resultsfolder', default="G:\\My Drive\\data_research\\NeuNet\\PID_Arithmetic\\resultsPID\\", help='path for PID analysis results')
+    parser.add_argument('-datafolder',    default=data_folder,  help='path of raw data')
+    parser.add_argument('-resultsfolder', default=rslts_folder, help='path for PID analysis results')
+    parser.add_argument('-cachefolder',   default=None, help='folder to cache decoded and resampled recordings, disabled if not given')
+    parser.add_argument('-seed',      type=int, default=None, help='seed of the surrogate random streams, drawn at random if not given')
+    parser.add_argument('-workers',   type=int, default=1, help='number of worker processes for the triplets, 1 runs serially')
+    parser.add_argument('-chunksize', type=int, default=165, help='number of triplets sent to a worker in each task')
+    parser.add_argument('-blocksize', type=int, default=55, help='number of triplets per checkpointed block of a surrogate run')
+    parser.add_argument('-format',    default='csv', help='surrogate results as one CSV per surrogate or a single Arrow stream file',choices=['csv','arrow'])
+    parser.add_argument('-sequential',help='stop drawing surrogates for a triplet once its test is settled (-samplesize is the maximum)',choices=["yes","no"],default="no")
+    parser.add_argument('-alpha',     type=float, default=0.05, help='significance level of the sequential surrogate test')
+    parser.add_argument('-stopcount', type=int, default=None, help='exceedances that stop a sequential test, floor(alpha*(samplesize+1)) if not given')
+    parser.add_argument('-profileslowest', type=int, default=0, help='number of slowest triplet chunks to profile with cProfile, 0 disables it')
+    parser.add_argument('-prefetch',  type=int, default=0, help='number of subjects loaded ahead in a background thread while the current one is analysed, with results written in the background, 0 disables it')
+    parser.add_argument('-store',     default=None, help='path of an indexed SQLite results store the original-data results are also written to, disabled if not given')
     args  = parser.parse_args()
-    stage =  "rest" if args.stageid  == "1" else "task"
-    Path(args.resultsfolder+"\\rest").mkdir(exist_ok=True)
-    Path(args.resultsfolder+"\\task").mkdir(exist_ok=True)
 
     subject_IDs    = args.subjectids
     
     start = time.time()
-    for ID in subject_IDs:
-        print('\nCurrently processing test subject', str(ID),'...',end='\n\n')
-        data_path       = args.datafolder + "Subject" + str(ID) + "_" + args.stageid + ".edf"
-        raw_data        = load_subjet_data(data_path)
-        useful_raw_data = only_useful_data(raw_data,dataset='ari',stage=stage)
-
-        if args.surrogates == 'yes':
-            samplesize     = int(args.samplesize)
-            for n in range(samplesize):
-                results         = {'source1':[],'source2':[],'target' :[],'sinergy':[],'unique1':[],'unique2':[],'redundancy':[]}
-                print("\nCurrently processing surrogate #"+str(n))
-                surrogates_path = args.resultsfolder  + stage + '_surrogates' +'\\nonbinary\\Subject' + str(ID) + "_PID_" + stage + "_surrogate"+str(n)+"_128Hz_NonBinary_5symbols.csv"
-                analyze_and_store_results(generate_surrogates(useful_raw_data), results, surrogates_path)
-        else:
-            results         = {'source1':[],'source2':[],'target' :[],'sinergy':[],'unique1':[],'unique2':[],'redundancy':[]}
-            result_path     = args.resultsfolder  + stage +'\\nonbinary\\Subject' + str(ID) + "_PID_" + stage + "_128Hz_NonBinary_5symbols.csv"
-            analyze_and_store_results(useful_raw_data, results, result_path)
-
-        print('\nFinished!\n\n')
+    with AsyncWriter() if args.prefetch > 0 else nullcontext() as writer:
+        for ID, recording in subject_recordings(subject_IDs, args.stageid, args.datafolder, args.cachefolder, args.prefetch):
+            print('\nCurrently processing test subject', str(ID),'...',end='\n\n')
+            samplesize = int(args.samplesize) if args.surrogates == 'yes' else 0
+            process_subject(ID, args.stageid, args.datafolder, args.resultsfolder, args.surrogates == 'yes', samplesize,
+                            args.cachefolder, args.seed, args.workers, args.chunksize, args.blocksize, args.format,
+                            args.profileslowest, args.sequential == 'yes', args.alpha, args.stopcount, recording, writer, args.store)
+            print('\nFinished!\n\n')
     end = time.time()
     print("ELAPSED TIME:",(end-start)/60)
 if __name__ == "__main__":
     main()
-
-
-
@@ -0,0 +1,198 @@
+import os
+import time
+import argparse
+import numpy  as np
+import pandas as pd
+from pathlib           import Path
+from scipy.signal      import butter, sosfiltfilt
+from recording         import Recording, as_recording, channel_matrix
+from brain_data_reader import get_file_paths_from_config, load_useful_data, binarize_data
+from dit_auxiliaries   import symbolize, pid_rows
+from discretisation    import discretise
+from pid_auxiliaries   import pid_analytical_rows, pid_rows_continuous
+from o_information     import GaussianEntropies, DiscreteEntropies, informations_table
+from joint_counts      import encode_channels
+from triplet_scheduler import run_triplets
+from results_store     import store_results
+from channels          import left_triplets, right_triplets
+
+# canonical EEG bands as (low, high) edges in Hz, None for an open edge:
+# delta < 4 Hz, theta 4-8 Hz, alpha 8-12 Hz, beta 12-30 Hz, gamma > 30 Hz (up to Nyquist, 64 Hz at 128 Hz)
+BANDS = {'delta' : (None, 4),
+         'theta' : (4, 8),
+         'alpha' : (8, 12),
+         'beta'  : (12, 30),
+         'gamma' : (30, None)}
+
+def band_filters(bands:dict, sfreq:float, order:int=4) -> dict:
+    """
+    Butterworth filters of each band in second-order sections: lowpass, highpass or bandpass depending on the open edges.
+    """
+    filters = {}
+    for band, (low, high) in bands.items():
+        if low is None:
+            filters[band] = butter(order, high, btype='lowpass', fs=sfreq, output='sos')
+        elif high is None:
+            filters[band] = butter(order, low, btype='highpass', fs=sfreq, output='sos')
+        else:
+            filters[band] = butter(order, [low, high], btype='bandpass', fs=sfreq, output='sos')
+    return filters
+
+def separate_bands(series:np.ndarray, sfreq:float=128, bands:dict=BANDS, method:str='sos', order:int=4) -> np.ndarray:
+    """
+    Filters every channel into every band at once.
+    Parameters:
+        series: array of shape (n_channels, n_samples).
+        sfreq: sampling frequency in Hz.
+        bands: dictionary of (low, high) band edges in Hz, None for an open edge.
+        method: 'sos' for zero-phase Butterworth filters (sosfiltfilt over all channels per band), or 'fft' for ideal
+                band masks applied to a single real FFT of all channels.
+        order: order of the Butterworth filters.
+    Returns:
+        array of shape (n_bands, n_channels, n_samples), bands in the order of 'bands', with the dtype of 'series'.
+    """
+    series = np.asarray(series)
+    if method == 'sos':
+        filters = band_filters(bands, sfreq, order)
+        return np.stack([sosfiltfilt(filters[band], series, axis=-1) for band in bands]).astype(series.dtype, copy=False)
+    if method == 'fft':
+        n_samples   = series.shape[-1]
+        frequencies = np.fft.rfftfreq(n_samples, d=1/sfreq)
+        masks       = np.stack([(frequencies >= (low or 0)) & (frequencies < (high or np.inf)) for low, high in bands.values()])
+        spectrum    = np.fft.rfft(series, axis=-1)
+        return np.fft.irfft(masks[:,np.newaxis,:]*spectrum, n=n_samples, axis=-1).astype(series.dtype, copy=False)
+    raise ValueError('unknown band separation method ' + str(method))
+
+class BandSeparation:
+    """
+    Band-separated recording: a (bands, channels, samples) array with per-band views as Recordings. The correlation matrix
+    and the discretisations of every band are computed once and shared by all the analyses run on it.
+    """
+    def __init__(self, data:pd.DataFrame, sfreq:float=128, bands:dict=BANDS, method:str='sos'):
+        self.channels = list(data.columns)
+        self.bands    = list(bands)
+        self.data     = separate_bands(channel_matrix(data), sfreq, bands, method)
+        self.cache    = {}
+
+    def _cached(self, key:tuple, compute):
+        if key not in self.cache:
+            self.cache[key] = compute()
+        return self.cache[key]
+
+    def recording(self, band:str) -> Recording:
+        return Recording(self.data[self.bands.index(band)], self.channels)
+
+    def correlation(self, band:str) -> np.ndarray:
+        return self._cached((band,'correlation'), lambda: np.corrcoef(self.data[self.bands.index(band)]))
+
+    def binarized(self, band:str) -> Recording:
+        return self._cached((band,'binary'), lambda: binarize_data(self.recording(band)))
+
+    def symbolized(self, band:str, pctls:tuple=(20,40,60,80)) -> Recording:
+        return self._cached((band,'symbolic',tuple(pctls)), lambda: symbolize(self.recording(band), list(pctls)))
+
+    def ordinal(self, band:str, dimension:int=3, delay:int=1) -> Recording:
+        return self._cached((band,'ordinal',dimension,delay), lambda: discretise(self.recording(band), 'ordinal', dimension=dimension, delay=delay))
+
+def empty_pid_results() -> dict:
+    return {'source1':[],'source2':[],'target' :[],'sinergy':[],'unique1':[],'unique2':[],'redundancy':[]}
+
+def analyze_band(separation:BandSeparation, band:str, mode:str, max_order:int=4, workers:int=1) -> pd.DataFrame:
+    """
+    Runs one PID or O-information mode on one band of a band-separated recording.
+    Parameters:
+        separation: band-separated recording.
+        band: name of the band.
+        mode: 'binary', 'nonbinary', 'ordinal' (ordinal patterns of 3 samples), 'continuous' or 'analytical' PID of all
+              triplets, or 'oinfo' (Gaussian) and 'oinfo_binary' (discrete, on the binarized band) O-information of all
+              n-tuples with 3 <= n <= max_order.
+        max_order: largest tuple size of the O-information modes.
+        workers: number of worker processes of the PID modes.
+    Returns:
+        data frame with the results.
+    """
+    triplets = left_triplets + right_triplets
+    if mode == 'binary':
+        results = empty_pid_results()
+        run_triplets(pid_rows, separation.binarized(band), triplets, results, workers, 165)
+    elif mode == 'nonbinary':
+        results = empty_pid_results()
+        run_triplets(pid_rows, separation.symbolized(band), triplets, results, workers, 165)
+    elif mode == 'ordinal':
+        results = empty_pid_results()
+        run_triplets(pid_rows, separation.ordinal(band), triplets, results, workers, 165)
+    elif mode == 'continuous':
+        results = empty_pid_results()
+        run_triplets(pid_rows_continuous, separation.recording(band), triplets, results, workers, 1)
+    elif mode == 'analytical':
+        results = {'source1':[],'source2':[],'target' :[],'sinergy':[],'redundancy':[]}
+        pid_analytical_rows(separation.recording(band), triplets, results, corr=separation.correlation(band))
+    elif mode == 'oinfo':
+        return informations_table(GaussianEntropies(separation.correlation(band)), separation.channels, max_order)
+    elif mode == 'oinfo_binary':
+        return informations_table(DiscreteEntropies(encode_channels(separation.binarized(band)), 2), separation.channels, max_order)
+    else:
+        raise ValueError('unknown mode ' + str(mode))
+    return pd.DataFrame(results)
+
+def process_subject(ID:int, stageid:str, data_folder:str, results_folder:str, cache_folder:str=None, bands:list=None,
+                    modes:list=('binary','analytical','oinfo'), method:str='sos', max_order:int=4, workers:int=1,
+                    store:str=None) -> int:
+    """
+    Separates the recording of one subject and stage into bands once, then runs every mode on every band and stores the
+    results as 'Subject<ID>_<stage>_<band>_<mode>.csv' in results_folder/<stage>/bands. With 'store' (the path of a
+    'results_store.ResultsStore') the PID results of every band are also stored in it.
+    Returns the number of (band, mode) analyses.
+    """
+    stage           = "rest" if stageid == "1" else "task"
+    data_path       = os.path.join(data_folder, "Subject" + str(ID) + "_" + stageid + ".edf")
+    useful_raw_data = as_recording(load_useful_data(data_path,dataset='ari',stage=stage,cache_dir=cache_folder))
+    selected        = {band:BANDS[band] for band in (bands or BANDS)}
+    separation      = BandSeparation(useful_raw_data, bands=selected, method=method)
+
+    result_folder = os.path.join(results_folder, stage, 'bands')
+    Path(result_folder).mkdir(parents=True, exist_ok=True)
+    for band in separation.bands:
+        for mode in modes:
+            print("Band", band, "-", mode)
+            result_path = os.path.join(result_folder, "Subject" + str(ID) + "_" + stage + "_" + band + "_" + mode + ".csv")
+            results     = analyze_band(separation, band, mode, max_order, workers)
+            results.to_csv(result_path)
+            if store is not None and 'target' in results.columns:      # O-information tables have no triplet rows
+                store_results(store, results, ID, stage, mode, band)
+    return len(separation.bands)*len(modes)
+
+def str_to_int_list(input_string):
+    return [int(item) for item in input_string.split(',')]
+
+def str_to_list(input_string):
+    return input_string.split(',')
+
+def main():
+    data_folder, rslts_folder = get_file_paths_from_config()
+    parser = argparse.ArgumentParser(description='Band-separated PID and O-information of every band in a single job')
+    parser.add_argument('-subjectids', type=str_to_int_list, help='List of integers separated by commas')
+    parser.add_argument("-stageid",help='stage of the experiment, can be 1 for rest or 2 for task',choices=["1","2"])
+    parser.add_argument('-bands',      type=str_to_list, default=list(BANDS), help='bands separated by commas: '+', '.join(BANDS))
+    parser.add_argument('-modes',      type=str_to_list, default=['binary','analytical','oinfo'],
+                        help='modes separated by commas: binary, nonbinary, ordinal, continuous, analytical, oinfo, oinfo_binary')
+    parser.add_argument('-method',     default='sos', help='zero-phase Butterworth filters or FFT band masks',choices=['sos','fft'])
+    parser.add_argument('-maxorder',   type=int, default=4, help='largest n-tuple size of the O-information modes')
+    parser.add_argument('-datafolder',    default=data_folder,  help='path of raw data')
+    parser.add_argument('-resultsfolder', default=rslts_folder, help='path for PID analysis results')
+    parser.add_argument('-cachefolder',   default=None, help='folder to cache decoded and resampled recordings, disabled if not given')
+    parser.add_argument('-workers',    type=int, default=1, help='number of worker processes for the triplets, 1 runs serially')
+    parser.add_argument('-store',      default=None, help='path of an indexed SQLite results store the PID results are also written to, disabled if not given')
+    args  = parser.parse_args()
+
+    start = time.time()
+    for ID in args.subjectids:
+        print('\nCurrently processing test subject', str(ID),'...',end='\n\n')
+        process_subject(ID, args.stageid, args.datafolder, args.resultsfolder, args.cachefolder, args.bands, args.modes,
+                        args.method, args.maxorder, args.workers, args.store)
+        print('\nFinished!\n\n')
+    end = time.time()
+    print("ELAPSED TIME:",(end-start)/60)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import time
+import argparse
+import PID_binary
+import PID_nonbinary
+import PID_continuous
+import PID_analytical_values
+import PID_quadruplets
+from itertools          import product
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from brain_data_reader  import get_file_paths_from_config
+
+# per-subject entry point of each PID mode
+MODES = {'binary'     : PID_binary.process_subject,
+         'nonbinary'  : PID_nonbinary.process_subject,
+         'continuous' : PID_continuous.process_subject,
+         'analytical' : PID_analytical_values.process_subject,
+         'quadruplets': PID_quadruplets.process_subject}
+
+def str_to_int_list(input_string):
+    return [int(item) for item in input_string.split(',')]
+
+def str_to_list(input_string):
+    return input_string.split(',')
+
+def available_memory_gb() -> float:
+    """
+    Physical memory currently available, in GB (None if it can't be determined on this platform).
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')/2**30
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def pool_size(workers:int, memory_budget_gb:float) -> int:
+    """
+    Number of worker processes: the requested number (all cores by default), limited so that each worker
+    can count on 'memory_budget_gb' of the memory available at startup ('has_memory_for' checks it again per job).
+    """
+    workers = workers or os.cpu_count()
+    memory  = available_memory_gb()
+    if memory is not None and memory_budget_gb > 0:
+        workers = min(workers, max(1, int(memory//memory_budget_gb)))
+    return workers
+
+def has_memory_for(memory_budget_gb:float) -> bool:
+    """
+    Whether the memory available now leaves 'memory_budget_gb' for one more job (True if it can't be determined).
+    """
+    memory = available_memory_gb()
+    return memory is None or memory_budget_gb <= 0 or memory >= memory_budget_gb
+
+def run_job(mode:str, ID:int, stageid:str, options:dict) -> tuple:
+    start    = time.time()
+    triplets = MODES[mode](ID, stageid, **options)
+    return triplets, time.time()-start
+
+def job_options(mode:str, args:argparse.Namespace) -> dict:
+    options = {'data_folder':args.datafolder, 'results_folder':args.resultsfolder, 'cache_folder':args.cachefolder, 'store':args.store}
+    if mode == 'analytical':
+        options.update({'miestimator':args.miestimator, 'surrogates':args.surrogates == 'yes', 'samplesize':args.samplesize, 'seed':args.seed,
+                        'alpha':args.alpha})
+    else:
+        options.update({'surrogates':args.surrogates == 'yes', 'samplesize':args.samplesize, 'seed':args.seed, 'result_format':args.format,
+                        'sequential':args.sequential == 'yes', 'alpha':args.alpha, 'stop_count':args.stopcount})
+    return options
+
+def main():
+    data_folder, rslts_folder = get_file_paths_from_config()
+    parser = argparse.ArgumentParser(description='Runs every subject x stage x mode PID job over a local pool of processes')
+    parser.add_argument('-subjectids', type=str_to_int_list, help='List of integers separated by commas')
+    parser.add_argument('-stageids',   type=str_to_list, default=['1','2'], help='stages separated by commas, 1 for rest and 2 for task')
+    parser.add_argument('-modes',      type=str_to_list, default=list(MODES), help='PID modes separated by commas: '+', '.join(MODES))
+    parser.add_argument("-surrogates", default='no', help='wether to do the PID analysis on original data or on Cholesky surrogates',choices=["yes","no"])
+    parser.add_argument("-samplesize", type=int, default=0, help='number of surrogate samples')
+    parser.add_argument('-seed',       type=int, default=None, help='seed of the surrogate random streams, drawn at random if not given')
+    parser.add_argument('-format',     default='csv', help='surrogate results as one CSV per surrogate or a single Arrow stream file',choices=['csv','arrow'])
+    parser.add_argument('-sequential', default='no', help='stop drawing surrogates for a triplet once its test is settled',choices=["yes","no"])
+    parser.add_argument('-alpha',      type=float, default=0.05, help='significance level of the sequential and analytical surrogate tests')
+    parser.add_argument('-stopcount',  type=int, default=None, help='exceedances that stop a sequential test, floor(alpha*(samplesize+1)) if not given')
+    parser.add_argument("-miestimator",default="ksg", help='source ranking of the analytical mode, its surrogates are tested against gaussian-ranked results',choices=["ksg","gaussian"])
+    parser.add_argument('-datafolder',    default=data_folder,  help='path of raw data')
+    parser.add_argument('-resultsfolder', default=rslts_folder, help='path for PID analysis results')
+    parser.add_argument('-cachefolder',   default=None, help='folder to cache decoded and resampled recordings, disabled if not given')
+    parser.add_argument('-store',         default=None, help='path of an indexed SQLite results store shared by all the jobs, disabled if not given')
+    parser.add_argument('-workers',       type=int,   default=0, help='number of worker processes, all cores if not given')
+    parser.add_argument('-memorybudget',  type=float, default=2.0, help='memory budget per worker in GB, limits the number of workers and is checked again before each job')
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error('unknown mode ' + mode)
+    if args.surrogates == 'yes' and args.samplesize < 1:
+        parser.error('-surrogates yes needs a -samplesize of at least 1')
+    jobs    = list(product(args.subjectids, args.stageids, args.modes))
+    workers = pool_size(args.workers, args.memorybudget)
+    print('Running', len(jobs), 'jobs on', workers, 'worker processes', end='\n\n')
+
+    # jobs are submitted one by one while a worker is free and the memory available leaves the budget for one more job,
+    # so the budget is checked against the memory used by the jobs already running
+    start          = time.time()
+    total_triplets = 0
+    succeeded      = 0
+    done           = 0
+    queue          = list(reversed(jobs))
+    futures        = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while queue or futures:
+            while queue and len(futures) < workers and (not futures or has_memory_for(args.memorybudget)):
+                ID, stageid, mode = queue.pop()
+                futures[pool.submit(run_job, mode, ID, stageid, job_options(mode, args))] = (ID, stageid, mode)
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                ID, stageid, mode = futures.pop(future)
+                done += 1
+                try:
+                    triplets, elapsed = future.result()
+                except Exception as error:
+                    print('[{0}/{1}] Subject {2}, stage {3}, {4}: FAILED ({5!r})'.format(done, len(jobs), ID, stageid, mode, error))
+                    continue
+                succeeded      += 1
+                total_triplets += triplets
+                print('[{0}/{1}] Subject {2}, stage {3}, {4}: {5} triplets in {6:.1f} min'.format(done, len(jobs), ID, stageid, mode, triplets, elapsed/60))
+    elapsed = time.time() - start
+    print("\nELAPSED TIME:", elapsed/60)
+    print("JOBS: {0} succeeded, {1} failed".format(succeeded, len(jobs) - succeeded))
+    print("THROUGHPUT: {0:.2f} jobs/hour, {1:.2f} triplets/sec".format(succeeded/elapsed*3600, total_triplets/elapsed))
+
+if __name__ == "__main__":
+    main()
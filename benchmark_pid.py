@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import dit
+import numpy  as np
+import pandas as pd
+from itertools         import product
+from mutual_info       import compute_mi, compute_cmi, compute_batch_mi
+from dit_auxiliaries   import pid_row, pid_row_nonbinary, symbolize, counts_to_distribution
+from pid_auxiliaries   import pid_row_continuous, pid_analytical, generate_surrogates, gaussian_mi
+from brain_data_reader import binarize_data
+from discrete_pid      import sliding_window_counts, window_starts
+from joint_counts      import encode_channels, tuple_counts
+
+# correlations of (x,y), (y,z) and (x,z) of the trivariate Gaussian used by the accuracy checks, as in test_analytical_PID.py
+ACCURACY_CORRELATIONS = (-0.1, 0.6, 0.5)
+
+def gaussian_data(n_samples:int, n_channels:int, rng:np.random.Generator) -> pd.DataFrame:
+    """
+    Synthetic multivariate Gaussian EEG-like data: channels mixed by a random correlation matrix.
+    """
+    mixing = rng.standard_normal((n_channels, n_channels))
+    cov    = mixing @ mixing.T + n_channels*np.eye(n_channels)
+    data   = rng.multivariate_normal(np.zeros(n_channels), cov, size=n_samples)
+    return pd.DataFrame(data, columns=['ch' + str(i) for i in range(n_channels)])
+
+def trivariate_gaussian(n_samples:int, rng:np.random.Generator) -> tuple:
+    """
+    Samples of the trivariate Gaussian with correlations ACCURACY_CORRELATIONS, and its correlation matrix.
+    """
+    a, b, c = ACCURACY_CORRELATIONS
+    corr    = np.array([[1,a,c], [a,1,b], [c,b,1]])
+    data    = rng.multivariate_normal(np.zeros(3), corr, size=n_samples)
+    return pd.DataFrame(data, columns=['x','y','z']), corr
+
+def pid_symbols(n_symbols:int) -> list:
+    """Percentiles splitting each channel into n_symbols equiprobable symbols."""
+    return list(np.linspace(0, 100, n_symbols+1)[1:-1])
+
+def best_time(function, repeat:int) -> float:
+    """Best wall time in seconds of 'repeat' calls of 'function'."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def empty_results() -> dict:
+    return {'source1':[],'source2':[],'target' :[],'sinergy':[],'unique1':[],'unique2':[],'redundancy':[]}
+
+def benchmark_cases(samples:list, channels:list, symbols:list) -> list:
+    """
+    (name, parameters, setup) of every benchmark of the sweep. 'setup' builds the inputs and returns the timed callable.
+    """
+    cases = []
+    for n in samples:
+        def mi_case(n=n):
+            x, y = gaussian_data(n, 2, np.random.default_rng(0)).to_numpy().T
+            return lambda: compute_mi(x, y)
+        def cmi_case(n=n):
+            x, y, z = gaussian_data(n, 3, np.random.default_rng(0)).to_numpy().T
+            return lambda: compute_cmi(x, y, z)
+        def batch_mi_case(n=n):
+            x, y = gaussian_data(n, 2, np.random.default_rng(0)).to_numpy().T
+            return lambda: compute_batch_mi(x, y)
+        def pid_row_case(n=n):
+            data = binarize_data(gaussian_data(n, 3, np.random.default_rng(0)))
+            return lambda: pid_row(data, list(data.columns), empty_results())
+        def continuous_case(n=n):
+            data = gaussian_data(n, 3, np.random.default_rng(0))
+            return lambda: pid_row_continuous(data.copy(), list(data.columns), empty_results())
+        def analytical_case(n=n):
+            data = gaussian_data(n, 3, np.random.default_rng(0))
+            return lambda: pid_analytical(data, list(data.columns), None, {key:[] for key in ['source1','source2','target','sinergy','redundancy']})
+        cases += [('compute_mi',         {'n_samples':n}, mi_case),
+                  ('compute_cmi',        {'n_samples':n}, cmi_case),
+                  ('compute_batch_mi',   {'n_samples':n}, batch_mi_case),
+                  ('pid_row',            {'n_samples':n}, pid_row_case),
+                  ('pid_row_continuous', {'n_samples':n}, continuous_case),
+                  ('pid_analytical',     {'n_samples':n}, analytical_case)]
+        for n_symbols in symbols:
+            def nonbinary_case(n=n, n_symbols=n_symbols):
+                data = symbolize(gaussian_data(n, 3, np.random.default_rng(0)), pid_symbols(n_symbols))
+                return lambda: pid_row_nonbinary(data, list(data.columns), empty_results())
+            def symbolize_case(n=n, n_symbols=n_symbols):
+                data = gaussian_data(n, 3, np.random.default_rng(0))
+                return lambda: symbolize(data, pid_symbols(n_symbols))
+            cases += [('pid_row_nonbinary', {'n_samples':n, 'n_symbols':n_symbols}, nonbinary_case),
+                      ('symbolize',         {'n_samples':n, 'n_symbols':n_symbols}, symbolize_case)]
+        for n_channels in channels:
+            def surrogates_case(n=n, n_channels=n_channels):
+                data = gaussian_data(n, n_channels, np.random.default_rng(0))
+                return lambda: generate_surrogates(data, seed=0)
+            def binarize_case(n=n, n_channels=n_channels):
+                data = gaussian_data(n, n_channels, np.random.default_rng(0))
+                return lambda: binarize_data(data)
+            cases += [('generate_surrogates', {'n_samples':n, 'n_channels':n_channels}, surrogates_case),
+                      ('binarize_data',       {'n_samples':n, 'n_channels':n_channels}, binarize_case)]
+    return cases
+
+def closed_form_pid(corr:np.ndarray, source1:int, source2:int, target:int) -> dict:
+    """
+    Minimum mutual information PID (in nats) of a Gaussian triplet from its correlation matrix.
+    """
+    r1, r2, b = corr[source1,target], corr[source2,target], corr[source1,source2]
+    I1, I2    = gaussian_mi(r1), gaussian_mi(r2)
+    I12       = -0.5*np.log(1 - (r1**2 + r2**2 - 2*r1*r2*b)/(1 - b**2))
+    r         = min(I1, I2)
+    return {'sinergy':I12 - I1 - I2 + r, 'unique1':I1 - r, 'unique2':I2 - r, 'redundancy':r}
+
+def binarized_gaussian_counts(corr:np.ndarray) -> np.ndarray:
+    """
+    Exact joint distribution of three median-binarized Gaussians (orthant probabilities), axes ordered as the channels.
+    """
+    p = np.empty((2,2,2))
+    for symbols in product((0,1), repeat=3):
+        signs      = 1 - 2*np.array(symbols)
+        p[symbols] = 1/8 + sum(signs[i]*signs[j]*np.arcsin(corr[i,j]) for i,j in [(0,1),(0,2),(1,2)])/(4*np.pi)
+    return p
+
+def accuracy_checks(n_samples:int=20000) -> list:
+    """
+    Compares the estimators with the closed-form values of the trivariate Gaussian with correlations ACCURACY_CORRELATIONS.
+    Returns one record per check with the estimate, the expected value, the absolute error and the tolerance.
+    """
+    data, corr = trivariate_gaussian(n_samples, np.random.default_rng(1))
+    x, y, z    = data.to_numpy().T
+    partial    = (corr[0,1] - corr[0,2]*corr[1,2])/np.sqrt((1 - corr[0,2]**2)*(1 - corr[1,2]**2))
+    checks     = [('compute_mi(x,y)',       compute_mi(x, y),       gaussian_mi(corr[0,1]), 0.02),
+                  ('compute_mi(y,z)',       compute_mi(y, z),       gaussian_mi(corr[1,2]), 0.02),
+                  ('compute_cmi(x,y|z)',    compute_cmi(x, y, z),   gaussian_mi(partial),   0.02),
+                  ('compute_batch_mi(y,z)', compute_batch_mi(y, z), gaussian_mi(corr[1,2]), 0.05)]
+
+    triplet    = ['x','y','z']
+    continuous = empty_results()
+    pid_row_continuous(data, triplet, continuous)
+    analytical = {key:[] for key in ['source1','source2','target','sinergy','redundancy']}
+    pid_analytical(data, triplet, None, analytical)
+    for row in range(3):
+        s1, s2, t = [triplet.index(continuous[key][row]) for key in ['source1','source2','target']]
+        expected  = closed_form_pid(corr, s1, s2, t)
+        for atom in ['sinergy','redundancy']:
+            checks.append(('pid_row_continuous ' + atom + ' ' + ''.join(triplet[i] for i in (s1,s2,t)), continuous[atom][row], expected[atom], 0.03))
+        s1, s2, t = [triplet.index(analytical[key][row]) for key in ['source1','source2','target']]
+        expected  = closed_form_pid(corr, s1, s2, t)
+        for atom in ['sinergy','redundancy']:
+            checks.append(('pid_analytical ' + atom + ' ' + ''.join(triplet[i] for i in (s1,s2,t)), analytical[atom][row], expected[atom], 0.01))
+
+    binary = empty_results()
+    pid_row(binarize_data(data), triplet, binary)
+    exact  = binarized_gaussian_counts(corr)
+    for row in range(3):
+        s1, s2, t = [triplet.index(binary[key][row]) for key in ['source1','source2','target']]
+        pid       = dit.pid.PID_WB(counts_to_distribution(np.transpose(exact, (s1,s2,t))))   # independent of 'discrete_pid'
+        expected  = {'sinergy':pid.get_pi(((0,1),)), 'unique1':pid.get_pi(((1,),)), 'unique2':pid.get_pi(((0,),)), 'redundancy':pid.get_pi(((0,),(1,)))}
+        for atom in ['sinergy','unique1','unique2','redundancy']:
+            checks.append(('pid_row ' + atom + ' ' + ''.join(triplet[i] for i in (s1,s2,t)), binary[atom][row], float(expected[atom]), 0.01))
+
+    codes    = encode_channels(binarize_data(data))
+    tuples   = np.array([[0,1,2],[2,0,1]])
+    windows  = list(sliding_window_counts(codes, tuples, 2, 1000, 250))
+    expected = [tuple_counts(codes[:,start:start+1000], tuples, 2) for start in window_starts(codes.shape[1], 1000, 250)]
+    checks.append(('sliding_window_counts', max(np.abs(window - counts).max() for window, counts in zip(windows, expected)) + abs(len(windows) - len(expected)), 0, 0))
+
+    return [{'check':name, 'estimate':float(estimate), 'expected':float(expected), 'abs_error':abs(float(estimate) - float(expected)),
+             'tolerance':tolerance, 'passed':bool(abs(estimate - expected) <= tolerance)} for name, estimate, expected, tolerance in checks]
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(timings:list, previous_path:str) -> None:
+    """Prints the speed-up of every benchmark with respect to a previous results file."""
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)
+    key       = lambda record: (record['benchmark'], json.dumps(record['parameters'], sort_keys=True))
+    reference = {key(record):record['seconds'] for record in previous['timings']}
+    print('\nSPEED-UP with respect to', previous.get('commit'))
+    for record in timings:
+        if key(record) in reference:
+            print('{0:22s} {1:45s} {2:8.2f}x'.format(record['benchmark'], key(record)[1], reference[key(record)]/record['seconds']))
+
+def str_to_int_list(input_string):
+    return [int(item) for item in input_string.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description='Timing and accuracy benchmarks of the MI estimators, PID kernels and surrogates')
+    parser.add_argument('-samples',  type=str_to_int_list, default=[1000,10000,100000], help='sample counts separated by commas')
+    parser.add_argument('-channels', type=str_to_int_list, default=[3,8,19], help='channel counts separated by commas')
+    parser.add_argument('-symbols',  type=str_to_int_list, default=[2,5,8], help='alphabet sizes separated by commas')
+    parser.add_argument('-repeat',   type=int, default=3, help='number of timed calls, the best one is kept')
+    parser.add_argument('-benchmarks', type=lambda s: s.split(','), default=None, help='only run these benchmarks, separated by commas')
+    parser.add_argument('-output',   default='benchmark_results.json', help='JSON file for the results')
+    parser.add_argument('-compare',  default=None, help='previous JSON results to compare timings with')
+    args   = parser.parse_args()
+
+    timings = []
+    for name, parameters, setup in benchmark_cases(args.samples, args.channels, args.symbols):
+        if args.benchmarks and name not in args.benchmarks:
+            continue
+        seconds = best_time(setup(), args.repeat)
+        timings.append({'benchmark':name, 'parameters':parameters, 'seconds':seconds, 'repeat':args.repeat})
+        print('{0:22s} {1:45s} {2:10.4f} s'.format(name, json.dumps(parameters), seconds))
+
+    checks = accuracy_checks()
+    print('\nACCURACY')
+    for check in checks:
+        print('{0:40s} {1:10.5f} {2:10.5f} {3}'.format(check['check'], check['estimate'], check['expected'], 'ok' if check['passed'] else 'FAILED'))
+
+    results = {'commit':git_commit(), 'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'), 'python':platform.python_version(),
+               'numpy':np.__version__, 'platform':platform.platform(), 'cpu_count':os.cpu_count(),
+               'timings':timings, 'accuracy':checks}
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=1)
+    if args.compare:
+        compare(timings, args.compare)
+    if not all(check['passed'] for check in checks):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,42 @@
+import os
+import json
+from configparser import ConfigParser
+import hashlib
+import tempfile
 import pandas as pd
 import numpy  as np
 import mne
+from pathlib import Path
+from discretisation import discretise
+from pid_metrics import stage as metrics_stage
 
-def load_subjet_data(path: str) -> pd.DataFrame:
+def get_file_paths_from_config():
+  current_directory = os.path.dirname(os.path.abspath(__file__))
+  config_file       = Path(current_directory) / 'config.ini'
+  config            = ConfigParser()
+  config.read(config_file)
+  data_path    = config.get('DEFAULT', 'data_path')
+  results_path = config.get('DEFAULT', 'results_path')
+  return data_path,results_path
+
+def load_subjet_data(path: str, sfreq:float=128) -> pd.DataFrame:
     """
     Loads an eeg or meg data set using the package mne and returns the data in a pandas DataFrame.
     Parameters:
         path: path to a single subject data set
+        sfreq: sampling frequency the edf recordings are resampled to
     Returns:
         pandas DataFrame with full data, including all channels.   
     """
 
     format = path[-3:]
     if format == 'edf':
-        return mne.io.read_raw_edf(path).copy().resample(sfreq=128).to_data_frame(verbose=False)
+        with metrics_stage('edf_load'):
+            raw = mne.io.read_raw_edf(path, preload=True)
+        with metrics_stage('resample', sfreq=sfreq):
+            raw = raw.resample(sfreq=sfreq)
+        with metrics_stage('to_data_frame'):
+            return raw.to_data_frame(verbose=False)
     elif format == 'set':
         return mne.io.read_raw_eeglab(path).to_data_frame(verbose=False)
     return
@@ -42,11 +65,89 @@ def binarize_data(data:pd.DataFrame) -> pd.DataFrame:
     """
     Discretizes each EEG channel data by assigning 1 to each observation if it's above the median and 0 if it's below.
        Parameters:
-           data: data frame with EEG channels data
+           data: data frame (or Recording) with EEG channels data
         Returns:
-            binary_data: Dataframe with binarized  EEG channels data.
+            binary_data: uint8 data frame with binarized  EEG channels data (a uint8 Recording if data is a Recording).
+    """
+    return discretise(data, 'binary')
+
+def atomic_write(path:Path, write) -> None:
+    """
+    Publishes a file atomically: 'write' is called on a binary file object of a unique temporary file in the same folder,
+    which then replaces 'path', so concurrent readers and writers (e.g. the jobs of 'batch_runner') never see partial files.
     """
-    binary_data = data.copy(deep=True)
-    for col in data.columns:
-        binary_data[col] = (binary_data[col] <= np.median(binary_data[col])).astype(int)
-    return binary_data
\ No newline at end of file
+    descriptor, temporary = tempfile.mkstemp(dir=Path(path).parent, prefix=Path(path).name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            write(file)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def file_hash(path: str, cache_dir: str) -> str:
+    """
+    SHA-256 of the contents of a file. Hashes are remembered in 'cache_dir'/file_hashes, one small JSON file per path with
+    its size and modification time, so unchanged files (e.g. on network-mounted data folders) are only read once and
+    concurrent processes never overwrite each other's entries.
+    """
+    key        = os.path.abspath(path)
+    index_path = Path(cache_dir) / 'file_hashes' / (hashlib.sha256(key.encode()).hexdigest() + '.json')
+    stat       = os.stat(path)
+    if index_path.exists():
+        entry = json.loads(index_path.read_text())
+        if entry['path'] == key and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256']
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(2**24), b''):
+            digest.update(block)
+    entry  = {'path':key, 'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns, 'sha256':digest.hexdigest()}
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(index_path, lambda file: file.write(json.dumps(entry).encode()))
+    return digest.hexdigest()
+
+def load_useful_data(path: str, dataset:str, stage:str, sfreq:float=128, cache_dir:str=None, columns:list[str]=None) -> pd.DataFrame:
+    """
+    Loads a subject data set and keeps only its useful data, as 'only_useful_data(load_subjet_data(path))'.
+    When a cache folder is given, the result is stored there as a channel-major float array (.npy) with its channel
+    names (.json), keyed by the hash of the file contents, the sampling frequency, the data set and the stage.
+    Later loads memory-map the array instead of decoding and resampling the recording again.
+    Parameters:
+        path: path to a single subject data set
+        dataset: id of the data set, see 'only_useful_data'
+        stage: stage of the experiment, see 'only_useful_data'
+        sfreq: sampling frequency the edf recordings are resampled to
+        cache_dir: folder of the cache, None disables it
+        columns: optional subset of channels to load, only these rows of the cached array are read
+    Returns:
+        pandas DataFrame with the useful channels data (a zero-copy view of the cached array when loading all columns).
+    """
+    if cache_dir is None:
+        raw_data = load_subjet_data(path, sfreq)
+        with metrics_stage('only_useful_data'):
+            useful_data = only_useful_data(raw_data, dataset, stage)
+        return useful_data if columns is None else useful_data[columns]
+
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    key        = hashlib.sha256(f"{file_hash(path, cache_dir)}-{sfreq}-{dataset}-{stage}".encode()).hexdigest()
+    array_path = Path(cache_dir) / (key + '.npy')
+    meta_path  = Path(cache_dir) / (key + '.json')
+    if not (array_path.exists() and meta_path.exists()):
+        raw_data = load_subjet_data(path, sfreq)
+        with metrics_stage('only_useful_data'):
+            useful_data = only_useful_data(raw_data, dataset, stage)
+        with metrics_stage('cache_write'):      # metadata first: the array is only visible once its channels are
+            metadata  = {'channels':list(useful_data.columns), 'source':os.path.abspath(path), 'sfreq':sfreq, 'dataset':dataset, 'stage':stage}
+            atomic_write(meta_path, lambda file: file.write(json.dumps(metadata).encode()))
+            atomic_write(array_path, lambda file: np.save(file, np.ascontiguousarray(useful_data.to_numpy().T)))
+
+    with metrics_stage('cache_load'):
+        channels = json.loads(meta_path.read_text())['channels']
+        array    = np.load(array_path, mmap_mode='r')
+    if columns is not None:
+        position = {channel:i for i,channel in enumerate(channels)}
+        array    = array[[position[channel] for channel in columns]]
+        channels = list(columns)
+    return pd.DataFrame(array.T, columns=channels, copy=False)
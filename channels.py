@@ -0,0 +1,8 @@
+from itertools import combinations
+
+# 10-20 EEG channels of each hemisphere, the midline channels Fz, Cz and Pz belong to both
+left_channels  = ['EEG Fp1', 'EEG F3', 'EEG F7', 'EEG T3', 'EEG C3', 'EEG T5', 'EEG P3', 'EEG O1', 'EEG Fz', 'EEG Cz', 'EEG Pz']
+right_channels = ['EEG Fp2', 'EEG F4', 'EEG F8', 'EEG T4', 'EEG C4', 'EEG T6', 'EEG P4', 'EEG O2', 'EEG Fz', 'EEG Cz', 'EEG Pz']
+
+left_triplets  = [list(triplet) for triplet in combinations(left_channels,3)]
+right_triplets = [list(triplet) for triplet in combinations(right_channels,3)]
@@ -0,0 +1,143 @@
+import os
+import json
+import pandas as pd
+from typing            import Callable
+from result_sink       import ResultSink
+from pid_metrics       import stage
+from brain_data_reader import atomic_write
+
+class Checkpoint:
+    """
+    Durable progress ledger of a surrogate run, stored as JSON lines next to its results. It records the root seed of the
+    surrogate streams, the layout of its triplet blocks (block size and number of triplets) and every completed unit, e.g.
+    (subject, stage, mode, surrogate index, triplet block). Each line is flushed to disk before the unit is considered done,
+    so a run killed at any point can be restarted from the ledger.
+    Units written to a ResultSink also record the number of rows of the sink, so rows past the last completed unit can be
+    discarded on restart.
+    """
+    def __init__(self, path:str):
+        self.path      = path
+        self.seed      = None
+        self.layout    = None
+        self.rows      = 0
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path) as ledger:
+                for line in ledger:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:      # last line of a run killed while writing
+                        continue
+                    if 'seed' in entry:
+                        self.seed = entry['seed']
+                    elif 'block_size' in entry:
+                        self.layout = (entry['block_size'], entry['triplets'])
+                    else:
+                        self.completed.add(tuple(entry['unit']))
+                        self.rows = entry.get('rows', self.rows)
+
+    def _append(self, entry:dict) -> None:
+        with open(self.path, 'a') as ledger:
+            ledger.write(json.dumps(entry) + '\n')
+            ledger.flush()
+            os.fsync(ledger.fileno())
+
+    def resolve_seed(self, seed:int) -> int:
+        """
+        Root seed of the run: the one stored by a previous session, or 'seed' (which must then be the seed actually used,
+        e.g. CholeskySurrogates.seed) on a fresh start. Restarting with a different explicit seed is an error, since it
+        would mix surrogates from different random streams.
+        """
+        if self.seed is None:
+            self.seed = seed
+            if seed is not None:
+                self._append({'seed':seed})
+        elif seed is not None and seed != self.seed:
+            raise ValueError('checkpoint ' + self.path + ' was started with seed ' + str(self.seed) + ', not ' + str(seed))
+        return self.seed
+
+    def resolve_layout(self, block_size:int, n_triplets:int) -> None:
+        """
+        Records the block size and number of triplets of the run on a fresh start. Blocks are identified by their position
+        only, so restarting with a different block size or list of triplets is an error: it would skip or repeat triplets.
+        """
+        layout = (block_size, n_triplets)
+        if self.layout is None:
+            self.layout = layout
+            self._append({'block_size':block_size, 'triplets':n_triplets})
+        elif layout != self.layout:
+            raise ValueError('checkpoint ' + self.path + ' was started with blocks of ' + str(self.layout[0]) + ' of ' +
+                             str(self.layout[1]) + ' triplets, not ' + str(block_size) + ' of ' + str(n_triplets))
+
+    def is_done(self, unit:tuple) -> bool:
+        return tuple(unit) in self.completed
+
+    def mark_done(self, unit:tuple, rows:int=None) -> None:
+        entry = {'unit':list(unit)}
+        if rows is not None:
+            entry['rows'] = self.rows = rows
+        self._append(entry)
+        self.completed.add(tuple(unit))
+
+def write_csv_atomically(frame:pd.DataFrame, path:str, index:bool=True) -> None:
+    atomic_write(path, lambda file: file.write(frame.to_csv(index=index).encode()))
+
+def run_surrogates_resumably(analyze:Callable, surrogates, n_surrogates:int, triplets:list, keys:list, output_path:Callable,
+                             checkpoint:Checkpoint, unit:tuple, block_size:int=55, sink:ResultSink=None,
+                             prepare:Callable=None) -> None:
+    """
+    Computes the PID of surrogates 0,...,n_surrogates-1 block of triplets by block, skipping the units already completed.
+    Without a sink, every block is written atomically to a partial file and recorded in the checkpoint; once all the blocks
+    of a surrogate are done they are consolidated into its output file (identical to an uninterrupted run) and the partial
+    files removed. With a sink, every block is appended to it as one batch tagged with the surrogate index.
+    Surrogates are drawn by index from their own random streams, so recomputed units reproduce the same data.
+    Parameters:
+        analyze: function with signature (data, triplets, results) that appends the PID rows of a list of triplets, e.g.
+                 over a 'triplet_scheduler.TripletPool' kept for the whole run.
+        surrogates: CholeskySurrogates of the recording, seeded with the checkpoint seed.
+        n_surrogates: number of surrogates.
+        triplets: list of triplets of channel names.
+        keys: columns of the results.
+        output_path: function returning the output file of surrogate n, unused with a sink.
+        checkpoint: progress ledger of the run, which must have been started with the same block size and triplets.
+        unit: prefix of the units of this run, e.g. (subject, stage, mode).
+        block_size: number of triplets per checkpointed block.
+        sink: ResultSink opened with the rows of the checkpoint, replaces the per-surrogate files.
+        prepare: function applied once to the data of every surrogate before its blocks are analysed, e.g. its
+                 discretisation, so the blocks do not redo it.
+    """
+    checkpoint.resolve_layout(block_size, len(triplets))
+    for n in range(n_surrogates):
+        path = None if sink is not None else output_path(n)
+        if checkpoint.is_done(unit + (n,)) and (sink is not None or os.path.exists(path)):
+            continue
+        print("\nCurrently processing surrogate #"+str(n))
+        with stage('surrogate', surrogate=n):
+            data = surrogates.frame(surrogates.surrogate(n))
+        if prepare is not None:
+            data = prepare(data)
+        parts = []
+        for block, start in enumerate(range(0, len(triplets), block_size)):
+            part_path = None if sink is not None else path + '.block' + str(block)
+            if sink is None:
+                parts.append(part_path)
+            if checkpoint.is_done(unit + (n,block)) and (sink is not None or os.path.exists(part_path)):
+                continue
+            results = {key:[] for key in keys}
+            analyze(data, triplets[start:start+block_size], results)
+            if sink is not None:
+                with stage('sink_write', surrogate=n, block=block):
+                    rows = sink.write(results, n)
+                checkpoint.mark_done(unit + (n,block), rows)
+                continue
+            with stage('csv_write', surrogate=n, block=block):
+                write_csv_atomically(pd.DataFrame(results), part_path, index=False)
+            checkpoint.mark_done(unit + (n,block))
+        if sink is None:
+            with stage('csv_write', surrogate=n):
+                rows = pd.concat([pd.read_csv(part_path, float_precision='round_trip') for part_path in parts], ignore_index=True)
+                write_csv_atomically(rows, path)
+        checkpoint.mark_done(unit + (n,))
+        for part_path in parts:
+            os.remove(part_path)
+    return
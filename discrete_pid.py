@@ -0,0 +1,153 @@
+import numpy as np
+from typing       import Dict, Iterator
+from itertools    import combinations
+from joint_counts import tuple_counts, permutation_counts
+
+# Nodes of the two-source redundancy lattice, named as in the tables printed by dit.pid.PID_WB
+PID_ATOMS = ['{0:1}', '{0}', '{1}', '{0}{1}']
+
+def redundancy_lattice(n_sources:int) -> list:
+    """
+    Nodes of the Williams-Beer redundancy lattice of n sources: the antichains of nonempty subsets of sources (collections
+    where no subset contains another), each as a tuple of tuples of source positions. 18 nodes for three sources.
+    """
+    subsets = [subset for size in range(1, n_sources+1) for subset in combinations(range(n_sources), size)]
+    nodes   = []
+    for size in range(1, len(subsets)+1):
+        for node in combinations(subsets, size):
+            if not any(set(a) <= set(b) for a,b in combinations(node, 2)):
+                nodes.append(tuple(sorted(node, key=lambda subset:(len(subset), subset))))
+    return nodes
+
+def lattice_name(node:tuple) -> str:
+    """Name of a lattice node as in the tables of 'dit', e.g. '{2}{0:1}'."""
+    return ''.join('{' + ':'.join(str(source) for source in subset) + '}' for subset in node)
+
+def mobius_matrix(nodes:list) -> np.ndarray:
+    """
+    Inverse of the zeta matrix of the lattice order (alpha <= beta when every subset of beta contains a subset of alpha),
+    so that the partial information of every node is its redundancy minus the partial information of the nodes below it.
+    """
+    below = np.array([[all(any(set(a) <= set(b) for a in lower) for b in upper) for lower in nodes] for upper in nodes], dtype=np.float64)
+    return np.rint(np.linalg.inv(below))
+
+# Nodes of the three-source redundancy lattice and their names, as in the tables printed by dit.pid.PID_WB
+LATTICE3   = redundancy_lattice(3)
+PID_ATOMS3 = [lattice_name(node) for node in LATTICE3]
+MOBIUS3    = mobius_matrix(LATTICE3)
+
+def specific_information(p_source_target:np.ndarray, p_target:np.ndarray) -> np.ndarray:
+    """
+    Computes the specific information I(T=t;A) in bits that a source A provides about each outcome of the target T.
+    Parameters:
+        p_source_target: joint probabilities of shape (..., n_source_symbols, n_target_symbols).
+        p_target: marginal probabilities of the target, shape (..., n_target_symbols).
+    Returns:
+        specific information with shape (..., n_target_symbols).
+    """
+    p_source = p_source_target.sum(axis=-1, keepdims=True)
+    p_t      = p_target[..., np.newaxis, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(p_source_target > 0,
+                         (p_source_target/p_t)*np.log2(p_source_target/(p_source*p_t)),
+                         0.0)
+    return terms.sum(axis=-2)
+
+def pid_wb(counts:np.ndarray) -> Dict[str,np.ndarray]:
+    """
+    Williams-Beer partial information decomposition (I_min redundancy) of two sources and one target,
+    computed directly from joint counts. Equivalent to dit.pid.PID_WB on the normalized distribution.
+    Parameters:
+        counts: joint counts of shape (..., n_symbols, n_symbols, n_symbols), with axes ordered as (source1, source2, target).
+                Leading axes are treated as a batch of independent distributions.
+    Returns:
+        pid_dict: dictionary with the partial information (in bits) of each atom, keyed as in the tables of 'dit'.
+    """
+    counts   = np.asarray(counts, dtype=np.float64)
+    batch    = counts.shape[:-3]
+    k0,k1,kt = counts.shape[-3:]
+    p        = counts/counts.sum(axis=(-3,-2,-1), keepdims=True)
+    p_target = p.sum(axis=(-3,-2))
+
+    i_spec0  = specific_information(p.sum(axis=-2), p_target)
+    i_spec1  = specific_information(p.sum(axis=-3), p_target)
+    i_spec01 = specific_information(p.reshape(batch+(k0*k1,kt)), p_target)
+
+    I0         = np.sum(p_target*i_spec0, axis=-1)
+    I1         = np.sum(p_target*i_spec1, axis=-1)
+    I01        = np.sum(p_target*i_spec01, axis=-1)
+    redundancy = np.sum(p_target*np.minimum(i_spec0, i_spec1), axis=-1)
+    return {'{0:1}'  : I01 - I0 - I1 + redundancy,
+            '{0}'    : I0 - redundancy,
+            '{1}'    : I1 - redundancy,
+            '{0}{1}' : redundancy}
+
+def pid_wb3(counts:np.ndarray) -> Dict[str,np.ndarray]:
+    """
+    Williams-Beer partial information decomposition (I_min redundancy) of three sources and one target, computed directly
+    from joint counts: the specific information of the 7 coalitions of sources is computed once per batch, the I_min
+    redundancy of the 18 lattice nodes is the expected minimum over their coalitions, and the partial information of the
+    nodes follows by Moebius inversion. Equivalent to dit.pid.PID_WB on the normalized distribution.
+    Parameters:
+        counts: joint counts of shape (..., K, K, K, n_target_symbols), with axes ordered as (source1, source2, source3,
+                target). Leading axes are treated as a batch of independent distributions.
+    Returns:
+        pid_dict: dictionary with the partial information (in bits) of each node of PID_ATOMS3, keyed as in the tables of 'dit'.
+    """
+    counts   = np.asarray(counts, dtype=np.float64)
+    batch    = counts.shape[:-4]
+    p        = counts/counts.sum(axis=(-4,-3,-2,-1), keepdims=True)
+    p_target = p.sum(axis=(-4,-3,-2))
+    i_spec   = {}
+    for subset in set(subset for node in LATTICE3 for subset in node):
+        others         = tuple(-4+source for source in range(3) if source not in subset)
+        marginal       = p.sum(axis=others) if others else p
+        i_spec[subset] = specific_information(marginal.reshape(batch + (-1, p.shape[-1])), p_target)
+    redundancy = np.stack([np.sum(p_target*np.min([i_spec[subset] for subset in node], axis=0), axis=-1) for node in LATTICE3], axis=-1)
+    partial    = redundancy @ MOBIUS3.T
+    return {atom:partial[...,n] for n,atom in enumerate(PID_ATOMS3)}
+
+def window_starts(n_samples:int, size:int, step:int) -> np.ndarray:
+    """First sample of every complete window of 'size' samples, moved by 'step' samples."""
+    return np.arange(0, n_samples-size+1, step)
+
+def sliding_window_counts(codes:np.ndarray, index_tuples:np.ndarray, n_symbols:int, size:int, step:int) -> Iterator[np.ndarray]:
+    """
+    Joint count tensors of many tuples of channels over a sliding window, updated incrementally: when the window moves, the
+    counts of the samples leaving it are subtracted and those of the samples entering it added, so every step costs
+    O(step) instead of O(size). Non-overlapping windows (step >= size) are counted from scratch.
+    Parameters:
+        codes: uint8 array of shape (n_channels, n_samples) as returned by 'encode_channels'.
+        index_tuples: integer array of shape (n_tuples, tuple_size) with the rows of 'codes' in each tuple.
+        n_symbols: size of the (common) alphabet of the channels.
+        size: number of samples per window.
+        step: number of samples the window moves at each step.
+    Returns:
+        iterator over int64 arrays of shape (n_tuples,) + (n_symbols,)*tuple_size, one per window of 'window_starts'. Every
+        window gets its own array, so the windows can be kept or buffered by the caller.
+    """
+    counts = None
+    for start in window_starts(codes.shape[1], size, step):
+        if counts is None or step >= size:
+            counts = tuple_counts(codes[:,start:start+size], index_tuples, n_symbols)
+        else:
+            counts = (counts - tuple_counts(codes[:,start-step:start], index_tuples, n_symbols)
+                             + tuple_counts(codes[:,start+size-step:start+size], index_tuples, n_symbols))   # a new array per window
+        yield counts
+
+def sliding_window_pid(codes:np.ndarray, index_triplets:np.ndarray, n_symbols:int, size:int, step:int) -> Dict[str,np.ndarray]:
+    """
+    Time-resolved PID of every permutation of many triplets, from count tensors maintained incrementally as the window moves.
+    The channels are discretised once for the whole recording, so the symbols of a sample don't depend on the window.
+    Parameters:
+        codes: uint8 array of shape (n_channels, n_samples) as returned by 'encode_channels'.
+        index_triplets: integer array of shape (n_triplets, 3) with the rows of 'codes' in each triplet.
+        n_symbols: size of the (common) alphabet of the channels.
+        size: number of samples per window.
+        step: number of samples the window moves at each step.
+    Returns:
+        pid_dict: dictionary with the partial information (in bits) of each atom, as arrays of shape (n_windows, n_triplets, 3)
+                  with the permutations of each triplet in the order of TRIPLET_PERMUTATIONS.
+    """
+    windows = [pid_wb(permutation_counts(counts)) for counts in sliding_window_counts(codes, index_triplets, n_symbols, size, step)]
+    return {atom:np.stack([pid[atom] for pid in windows]) for atom in PID_ATOMS}
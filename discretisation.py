@@ -0,0 +1,118 @@
+import numpy  as np
+import pandas as pd
+from math      import factorial
+from typing    import Iterable, Iterator, Union
+from recording import Recording, channel_matrix
+
+def quantile_edges(series:np.ndarray, pctls:list) -> np.ndarray:
+    """
+    Bin edges of every channel at the given percentiles, from a single call over all channels.
+    Parameters:
+        series: array of shape (n_channels, n_samples).
+        pctls: increasing percentiles in [0,100].
+    Returns:
+        array of shape (n_channels, len(pctls)).
+    """
+    return np.percentile(series, pctls, axis=1).T
+
+def quantile_codes(series:np.ndarray, edges:np.ndarray) -> np.ndarray:
+    """
+    Bin of every sample among the edges of its channel, as np.digitize: the number of edges lower or equal to the sample.
+    Parameters:
+        series: array of shape (n_channels, n_samples).
+        edges: array of shape (n_channels, n_edges) of increasing edges per channel, n_edges < 256.
+    Returns:
+        uint8 array of shape (n_channels, n_samples) with codes in [0, n_edges].
+    """
+    series = np.asarray(series)
+    codes  = np.zeros(series.shape, dtype=np.uint8)
+    for edge in np.asarray(edges).T:
+        codes += series >= edge[:,np.newaxis]
+    return codes
+
+def binary_codes(series:np.ndarray, medians:np.ndarray=None) -> np.ndarray:
+    """
+    1 for the samples lower or equal to the median of their channel, 0 otherwise, as uint8 of shape (n_channels, n_samples).
+    The medians of the channels are computed from 'series' if not given.
+    """
+    series  = np.asarray(series)
+    medians = np.median(series, axis=1) if medians is None else np.asarray(medians)
+    return (series <= medians[:,np.newaxis]).astype(np.uint8)
+
+def ordinal_codes(series:np.ndarray, dimension:int=3, delay:int=1) -> np.ndarray:
+    """
+    Ordinal pattern (permutation) symbols of every channel: the embedding vector (x_t, x_t+delay, ..., x_t+(dimension-1)delay)
+    is replaced by the Lehmer code of the permutation that sorts it (ties broken by order of appearance, as a stable argsort).
+    Codes are the ranks of the permutations in lexicographic order, so the pattern of a vector sorted in increasing order is 0.
+    Parameters:
+        series: array of shape (n_channels, n_samples).
+        dimension: embedding dimension, at most 5 so that the dimension! symbols fit in uint8.
+        delay: embedding delay in samples.
+    Returns:
+        uint8 array of shape (n_channels, n_samples - (dimension-1)*delay) with codes in [0, dimension!).
+    """
+    if factorial(dimension) > 256:
+        raise ValueError('ordinal patterns of dimension ' + str(dimension) + ' do not fit in uint8 codes')
+    series   = np.asarray(series)
+    length   = series.shape[1] - (dimension-1)*delay
+    if length <= 0:
+        return np.zeros((series.shape[0], 0), dtype=np.uint8)
+    vectors  = np.stack([series[:,i*delay:i*delay+length] for i in range(dimension)], axis=1)
+    sorting  = np.argsort(vectors, axis=1, kind='stable')
+    codes    = np.zeros((series.shape[0], length), dtype=np.uint8)
+    for i in range(dimension-1):
+        smaller = np.sum(sorting[:,i+1:,:] < sorting[:,i:i+1,:], axis=1)   # Lehmer digit of position i
+        codes  += (smaller*factorial(dimension-1-i)).astype(np.uint8)
+    return codes
+
+def iter_quantile_codes(chunks:Iterable[np.ndarray], edges:np.ndarray) -> Iterator[np.ndarray]:
+    """
+    Streaming 'quantile_codes': codes of every (n_channels, chunk_size) chunk against edges fitted beforehand (e.g. with
+    'quantile_edges' on the whole recording or on a calibration segment).
+    """
+    for chunk in chunks:
+        yield quantile_codes(chunk, edges)
+
+def iter_ordinal_codes(chunks:Iterable[np.ndarray], dimension:int=3, delay:int=1) -> Iterator[np.ndarray]:
+    """
+    Streaming 'ordinal_codes': the last (dimension-1)*delay samples of every chunk are carried over to the next one, so
+    the concatenated codes equal the codes of the whole series.
+    """
+    overlap = (dimension-1)*delay
+    tail    = None
+    for chunk in chunks:
+        chunk = np.asarray(chunk) if tail is None else np.concatenate([tail, chunk], axis=1)
+        yield ordinal_codes(chunk, dimension, delay)
+        tail  = chunk[:,chunk.shape[1]-overlap:]
+
+def as_codes(data:Union[pd.DataFrame,Recording], codes:np.ndarray) -> Union[pd.DataFrame,Recording]:
+    """
+    Wraps channel-major codes like the data they come from: a uint8 Recording, or a data frame with the same columns
+    (and index, when the codes have one per sample).
+    """
+    if isinstance(data, Recording):
+        return Recording(codes, data.channels)
+    index = data.index if codes.shape[1] == len(data.index) else None
+    return pd.DataFrame(codes.T, index=index, columns=data.columns)
+
+def discretise(data:Union[pd.DataFrame,Recording], method:str='quantile', pctls:list=(20,40,60,80), dimension:int=3,
+               delay:int=1) -> Union[pd.DataFrame,Recording]:
+    """
+    Discretizes all the EEG channels at once into compact uint8 codes ready for joint counting.
+    Parameters:
+        data: data frame (or Recording) with continuous EEG channels data.
+        method: 'quantile' (bins between the 'pctls' percentiles of each channel), 'binary' (1 at or below the median of
+                each channel) or 'ordinal' (ordinal patterns of 'dimension' samples 'delay' apart, see 'ordinal_codes').
+    Returns:
+        codes wrapped like 'data' (see 'as_codes'). Ordinal codes are (dimension-1)*delay samples shorter than the data.
+    """
+    series = channel_matrix(data)
+    if method == 'quantile':
+        codes = quantile_codes(series, quantile_edges(series, list(pctls)))
+    elif method == 'binary':
+        codes = binary_codes(series)
+    elif method == 'ordinal':
+        codes = ordinal_codes(series, dimension, delay)
+    else:
+        raise ValueError('unknown discretisation method ' + str(method))
+    return as_codes(data, codes)
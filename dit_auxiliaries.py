@@ -2,31 +2,40 @@ import dit
 import numpy  as np
 import pandas as pd
 from typing import Dict
-from scipy.linalg import cholesky
+from surrogates import CholeskySurrogates
+from discrete_pid import pid_wb, pid_wb3, PID_ATOMS3
+from discretisation import discretise
+from joint_counts import TRIPLET_PERMUTATIONS, QUADRUPLET_PERMUTATIONS, encode_channels, count_joint_symbols, triplet_counts, tuple_counts, permutation_counts, channel_indices
 
 def symbolize(data:pd.DataFrame,pctls:list[int]) -> pd.DataFrame:
     """
     Discretizes each EEG channel data by binning the continuous values according to a given set of percentile values that function as catagories
        Parameters:
-           data: data frame with raw EEG data
+           data: data frame (or Recording) with raw EEG data
         Returns:
-            symbolic_data: Dataframe with discretized EEG data.
-    """
-    
-    symbolic_data = data.copy(deep=True)
-    for col in data.columns:
-        boundaries         = [np.percentile(data[col],q) for q in pctls]
-        symbolic_data[col] = np.digitize(data[col],boundaries)
-    return symbolic_data
+            symbolic_data: uint8 data frame with discretized EEG data (a uint8 Recording if data is a Recording).
+    """
+    return discretise(data, 'quantile', pctls)
 
 def joint_symbols_to_string(symbols):
     return np.array2string(symbols,separator='')[1:-1]
 
+def counts_to_distribution(counts:np.ndarray) -> dit.Distribution:
+    """
+    Builds a 'dit' Distribution from a joint count tensor, keeping only the joint symbols that were observed.
+    Parameters:
+        counts: joint counts of shape (n_symbols,)*n_variables.
+    Returns:
+        distribution: a 'dit' Distribution object with the relative frequencies of the observed joint symbols.
+    """
+    joint_symbols  = np.argwhere(counts > 0)
+    frequencies    = counts[tuple(joint_symbols.T)]
+    symbol_strings = list(map(joint_symbols_to_string,joint_symbols))
+    return dit.Distribution(symbol_strings, frequencies/sum(frequencies))
+
 def partial_info_decomp(r1,r2,r3):
-    joint_symbols,freqs = np.unique(list(zip(r1,r2,r3)), axis=0, return_counts=True)
-    symbol_strings      = list(map(joint_symbols_to_string,joint_symbols))
-    distribution        = dit.Distribution(symbol_strings, freqs/sum(freqs))
-    pid                 = dit.pid.PID_WB(distribution)
+    n_symbols = int(max(np.max(r1),np.max(r2),np.max(r3))) + 1
+    pid       = dit.pid.PID_WB(counts_to_distribution(count_joint_symbols(r1,r2,r3,n_symbols=n_symbols)))
     return read_pid_table(str(pid))
 
 # terminar type hints de función "boolean_joint_distribution"
@@ -39,12 +48,8 @@ def boolean_joint_distribution(*random_variates):
     Returns:
         distribution: a 'dit' Distribution object representing the joint distribution of 'variables'
     """
-    def joint_symbols_to_string(bits:np.ndarray)->str:
-        return np.array2string(bits,separator='')[1:-1]
-    joint_symbols,frequencies = np.unique(list(zip(*random_variates)), axis=0, return_counts=True)
-    symbol_strings            = list(map(joint_symbols_to_string,joint_symbols))
-    distribution              = dit.Distribution(symbol_strings, frequencies/sum(frequencies))
-    return distribution
+    n_symbols = int(max(np.max(variate) for variate in random_variates)) + 1
+    return counts_to_distribution(count_joint_symbols(*random_variates,n_symbols=n_symbols))
 
 def read_pid_table(pid_table: str) -> Dict[str,float]: 
     """
@@ -80,74 +85,80 @@ def triplet_pid_to_csv(data: pd.DataFrame, triplet:frozenset, savepath:str) -> N
         text_file.write(dit.pid.PID_WB(distro3).to_string())
     return
 
-def pid_row(data: pd.DataFrame, triplet:list, results:Dict[str,list]) -> None:
-    rvs      = data[triplet].to_numpy().T 
-    def fill_row(i,j,k):
-        distro = boolean_joint_distribution(rvs[i],rvs[j],rvs[k])
-        pid    = read_pid_table(dit.pid.PID_WB(distro).to_string())
+def append_pid_rows(triplet:list, pids:Dict[str,np.ndarray], results:Dict[str,list]) -> None:
+    """
+    Appends the pid of the three source/target permutations of a triplet to the results dictionary.
+    Parameters:
+        triplet: channel names of the triplet.
+        pids: dictionary of atoms as returned by 'pid_wb', each of length 3 (one value per permutation).
+        results: dictionary of lists where the rows are appended.
+    """
+    for n,(i,j,k) in enumerate(TRIPLET_PERMUTATIONS):
         results['source1'].append(triplet[i])
         results['source2'].append(triplet[j])
         results['target'].append(triplet[k])
-        results['sinergy'].append(pid['{0:1}'])
-        results['unique1'].append(pid['{1}'])
-        results['unique2'].append(pid['{0}'])
-        results['redundancy'].append(pid['{0}{1}'])
-    fill_row(0,1,2)
-    fill_row(0,2,1)
-    fill_row(1,2,0)
-    return 
-    
+        results['sinergy'].append(pids['{0:1}'][n])
+        results['unique1'].append(pids['{1}'][n])
+        results['unique2'].append(pids['{0}'][n])
+        results['redundancy'].append(pids['{0}{1}'][n])
+    return
+
+def pid_row(data: pd.DataFrame, triplet:list, results:Dict[str,list]) -> None:
+    pid_rows(data[triplet], [triplet], results)
+    return
+
 def pid_row_nonbinary(data: pd.DataFrame, triplet:list, results:Dict[str,list]) -> None:
-    rvs = data[triplet].to_numpy().T 
-    def fill_row(i,j,k):
-        pid    = partial_info_decomp(rvs[i],rvs[j],rvs[k])
-        results['source1'].append(triplet[i])
-        results['source2'].append(triplet[j])
-        results['target'].append(triplet[k])
-        results['sinergy'].append(pid['{0:1}'])
-        results['unique1'].append(pid['{1}'])
-        results['unique2'].append(pid['{0}'])
-        results['redundancy'].append(pid['{0}{1}'])
-    fill_row(0,1,2)
-    fill_row(0,2,1)
-    fill_row(1,2,0)
-    return 
+    pid_rows(data[triplet], [triplet], results)
+    return
 
-def generate_surrogates(data_df:pd.DataFrame) -> pd.DataFrame:
+def pid_rows(data: pd.DataFrame, triplets:list, results:Dict[str,list]) -> None:
+    """
+    Williams-Beer PID of all the source/target permutations of a collection of triplets, evaluated in a single batch.
+    Each channel is encoded once and each triplet is counted once; its permutations are transpositions of the same counts.
+    Rows are appended in the same order as calling 'pid_row' on each triplet.
+    Parameters:
+        data: data frame with integer coded (binary or symbolic) EEG channels data.
+        triplets: list of triplets of channel names.
+        results: dictionary of lists where the rows are appended.
+    """
+    codes     = encode_channels(data)
+    n_symbols = int(codes.max()) + 1
+    counts    = permutation_counts(triplet_counts(codes, channel_indices(list(data.columns),triplets), n_symbols))
+    pids      = pid_wb(counts)
+    for n,triplet in enumerate(triplets):
+        append_pid_rows(triplet, {atom:values[n] for atom,values in pids.items()}, results)
+    return
+
+def pid_rows_quadruplets(data: pd.DataFrame, quadruplets:list, results:Dict[str,list]) -> None:
+    """
+    Three-source Williams-Beer PID of the four source/target permutations (QUADRUPLET_PERMUTATIONS) of a collection of
+    quadruplets, evaluated in a single batch from the joint counts of each quadruplet.
+    Parameters:
+        data: data frame with integer coded (binary or symbolic) EEG channels data.
+        quadruplets: list of quadruplets of channel names.
+        results: dictionary of lists where the rows are appended, with keys 'source1', 'source2', 'source3', 'target' and
+                 the lattice nodes of PID_ATOMS3 (e.g. '{0:1:2}' for the synergy of the three sources).
+    """
+    codes     = encode_channels(data)
+    n_symbols = int(codes.max()) + 1
+    counts    = tuple_counts(codes, channel_indices(list(data.columns),quadruplets), n_symbols)
+    pids      = pid_wb3(permutation_counts(counts, QUADRUPLET_PERMUTATIONS))
+    for n,quadruplet in enumerate(quadruplets):
+        for m,permutation in enumerate(QUADRUPLET_PERMUTATIONS):
+            for key,position in zip(('source1','source2','source3','target'), permutation):
+                results[key].append(quadruplet[position])
+            for atom in PID_ATOMS3:
+                results[atom].append(pids[atom][n,m])
+    return
+
+def generate_surrogates(data_df:pd.DataFrame, seed:int=None) -> pd.DataFrame:
     """
     Creates a sample of surrogate data via Cholesky decomposition.
     Parameters:
         data_df: a dataframe containing only the useful columns of the EEG data
+        seed: optional seed of the random stream
     Returns:
         surrogate_df: a dataframe containing the Cholesky surrogates
     """
-    def permutation_cholesky_surrogates(series):
-        s = np.copy(series)
-
-        for i in range(len(s)):
-            s[i] = np.random.permutation(s[i])
-            s[i] = (s[i]-np.mean(s[i]))/np.std(s[i])
-        pearson_corr  = np.corrcoef(series)
-        x             = s
-        c             = cholesky(pearson_corr, lower=True)
-        choles        = np.dot(c, x)
-        return choles
-    def gaussian_cholesky_surrogates(series):
-        pearson_corr  = np.corrcoef(series)
-        x             = np.random.normal(size=series.shape)
-        c             = cholesky(pearson_corr, lower=True)
-        choles        = np.dot(c, x)
-        return choles   
-    def random_permutation_surrogates(series):
-        rng   = np.random.default_rng()
-        return rng.permuted(series, axis=1)
-    data_array      = data_df.to_numpy()
-    surrogate_array = gaussian_cholesky_surrogates(data_array.T)#surrogate_array = random_permutation_surrogates(data_array.T)
-    surrogate_df    = pd.DataFrame(surrogate_array.T,columns=data_df.columns)
-    return surrogate_df
-
-
-    
-    
-
-
+    surrogates = CholeskySurrogates(data_df, seed)
+    return surrogates.frame(surrogates.surrogate(0))
@@ -0,0 +1,86 @@
+import numpy  as np
+import pandas as pd
+from recording import channel_matrix
+
+# (source1, source2, target) positions of the three permutations of a triplet analysed by the PID scripts
+TRIPLET_PERMUTATIONS = [(0,1,2),(0,2,1),(1,2,0)]
+
+# (source1, source2, source3, target) positions of the four permutations of a quadruplet, one per target channel
+QUADRUPLET_PERMUTATIONS = [(0,1,2,3),(0,1,3,2),(0,2,3,1),(1,2,3,0)]
+
+def encode_channels(data:pd.DataFrame) -> np.ndarray:
+    """
+    Encodes integer coded (binary or symbolic) EEG channels data once as a compact channel-major array.
+    Parameters:
+        data: data frame (or Recording) with integer coded EEG channels data, with symbols in [0,256).
+    Returns:
+        codes: uint8 array of shape (n_channels, n_samples), rows ordered as data.columns. Not copied for uint8 recordings.
+    """
+    return np.ascontiguousarray(channel_matrix(data), dtype=np.uint8)
+
+def count_joint_symbols(*random_variates, n_symbols:int) -> np.ndarray:
+    """
+    Counts the joint occurrences of a collection of integer coded random variables.
+    Parameters:
+        random_variates: observations of each random variable, coded as integers in [0,n_symbols).
+        n_symbols: size of the (common) alphabet of the random variables.
+    Returns:
+        counts: array of shape (n_symbols,)*len(random_variates) with the joint counts.
+    """
+    n_variables = len(random_variates)
+    codes       = np.zeros(len(random_variates[0]), dtype=np.int64)
+    for variate in random_variates:
+        codes = codes*n_symbols + np.asarray(variate, dtype=np.int64)
+    counts = np.bincount(codes, minlength=n_symbols**n_variables)
+    return counts.reshape((n_symbols,)*n_variables)
+
+def tuple_counts(codes:np.ndarray, index_tuples:np.ndarray, n_symbols:int, block_size:int=2**24) -> np.ndarray:
+    """
+    Joint count tensors of many tuples of channels, accumulated with a single bincount per block of tuples.
+    Parameters:
+        codes: uint8 array of shape (n_channels, n_samples) as returned by 'encode_channels'.
+        index_tuples: integer array of shape (n_tuples, tuple_size) with the rows of 'codes' in each tuple.
+        n_symbols: size of the (common) alphabet of the channels.
+        block_size: maximum number of combined codes held in memory at once.
+    Returns:
+        counts: int64 array of shape (n_tuples,) + (n_symbols,)*tuple_size.
+    """
+    index_tuples     = np.asarray(index_tuples, dtype=np.intp)
+    n_tuples, n_vars = index_tuples.shape
+    n_cells          = n_symbols**n_vars
+    tuples_per_block = max(1, block_size//codes.shape[1])
+    counts           = np.empty((n_tuples,n_cells), dtype=np.int64)
+    for start in range(0, n_tuples, tuples_per_block):
+        block      = index_tuples[start:start+tuples_per_block]
+        code_dtype = np.uint32 if len(block)*n_cells <= np.iinfo(np.uint32).max else np.int64
+        combined   = np.zeros((len(block),codes.shape[1]), dtype=code_dtype)
+        for v in range(n_vars):
+            combined *= n_symbols
+            combined += codes[block[:,v]]
+        combined += (np.arange(len(block), dtype=code_dtype)*n_cells)[:,np.newaxis]
+        counts[start:start+len(block)] = np.bincount(combined.ravel(), minlength=len(block)*n_cells).reshape(len(block),n_cells)
+    return counts.reshape((n_tuples,)+(n_symbols,)*n_vars)
+
+def triplet_counts(codes:np.ndarray, index_triplets:np.ndarray, n_symbols:int) -> np.ndarray:
+    """
+    Joint count tensors of every requested triplet, with axes ordered as the channels in each triplet.
+    """
+    return tuple_counts(codes, index_triplets, n_symbols)
+
+def permutation_counts(counts:np.ndarray, permutations:list=TRIPLET_PERMUTATIONS) -> np.ndarray:
+    """
+    Expands tuple count tensors into source/target permutations by transposition.
+    Parameters:
+        counts: array of shape (n_tuples, K, ..., K).
+        permutations: axes of every permutation, TRIPLET_PERMUTATIONS or QUADRUPLET_PERMUTATIONS.
+    Returns:
+        array of shape (n_tuples, n_permutations, K, ..., K) with axes (sources..., target) in the last dimensions.
+    """
+    return np.stack([np.transpose(counts,(0,)+tuple(1+i for i in permutation)) for permutation in permutations], axis=1)
+
+def channel_indices(channels:list, tuples:list) -> np.ndarray:
+    """
+    Translates tuples of channel names into an integer array of positions in 'channels'.
+    """
+    position = {channel:i for i,channel in enumerate(channels)}
+    return np.array([[position[channel] for channel in t] for t in tuples], dtype=np.intp)
@@ -0,0 +1,76 @@
+import weakref
+import numpy  as np
+import pandas as pd
+from collections import OrderedDict
+from mutual_info import build_tree, preprocess_data
+from mutual_info import compute_mi, compute_cmi, block_estimates
+
+class KSGCache:
+    """
+    Per-recording memoization of KSG estimates. Pairwise mutual informations are stored by channel pair and n_neighbors,
+    and the neighbor-counting structures (sorted arrays or Chebyshev KDTrees) of the
+    (preprocessed) marginals are stored by channel set, so that each of them is computed
+    once per recording no matter how many triplets or permutations need it. Both stores are bounded and evict the least
+    recently used entries.
+    """
+    def __init__(self, data:pd.DataFrame, max_tree_bytes:int=2**30, max_values:int=2**16):
+        self.data           = data
+        self.max_tree_bytes = max_tree_bytes
+        self.max_values     = max_values
+        self.tree_bytes     = 0
+        self.trees          = OrderedDict()
+        self.values         = OrderedDict()
+
+    def tree(self, channels:list):
+        key = frozenset(channels)
+        if key in self.trees:
+            self.trees.move_to_end(key)
+            return self.trees[key][0]
+        points = np.hstack([preprocess_data(self.data[channel]) for channel in channels])
+        kd     = build_tree(points)
+        size   = sum(array.nbytes for array in kd.get_arrays())
+        self.trees[key]  = (kd, size)
+        self.tree_bytes += size
+        while self.tree_bytes > self.max_tree_bytes and len(self.trees) > 1:
+            _, (_, evicted_size) = self.trees.popitem(last=False)
+            self.tree_bytes     -= evicted_size
+        return kd
+
+    def mi(self, x:str, y:str, n_neighbors:int=3) -> float:
+        key = (frozenset((x,y)), n_neighbors)
+        if key in self.values:
+            self.values.move_to_end(key)
+            return self.values[key]
+        value = compute_mi(self.data[x], self.data[y], n_neighbors, x_tree=self.tree([x]), y_tree=self.tree([y]))
+        self.values[key] = value
+        if len(self.values) > self.max_values:
+            self.values.popitem(last=False)
+        return value
+
+    def cmi(self, x:str, y:str, z:str, n_neighbors:int=3) -> float:
+        return compute_cmi(self.data[x], self.data[y], self.data[z], n_neighbors,
+                           xz_tree=self.tree([x,z]), yz_tree=self.tree([y,z]), z_tree=self.tree([z]))
+
+    def block_mi(self, x:str, y:str, starts:np.ndarray, block_size:int, n_neighbors:int=3) -> np.ndarray:
+        """KSG mutual information of a pair of channels on every block of 'starts', memoized like 'mi'."""
+        key = (frozenset((x,y)), n_neighbors, block_size, tuple(starts))
+        if key in self.values:
+            self.values.move_to_end(key)
+            return self.values[key]
+        value = block_estimates(compute_mi, [self.data[x], self.data[y]], starts, block_size, n_neighbors=n_neighbors)
+        self.values[key] = value
+        if len(self.values) > self.max_values:
+            self.values.popitem(last=False)
+        return value
+
+_recording_caches = {}
+
+def recording_cache(data:pd.DataFrame) -> KSGCache:
+    """
+    Returns the KSGCache attached to a recording, creating it on first use. The cache is dropped with the recording.
+    """
+    key = id(data)
+    if key not in _recording_caches:
+        _recording_caches[key] = KSGCache(weakref.proxy(data))
+        weakref.finalize(data, _recording_caches.pop, key, None)
+    return _recording_caches[key]
@@ -8,6 +8,7 @@ import numpy as np
 from numpy.random import default_rng
 from scipy.special import digamma
 from sklearn.neighbors import KDTree
+from concurrent.futures import ProcessPoolExecutor
 
 
 def get_radius_kneighbors(x, n_neighbors):
@@ -29,16 +30,88 @@ def get_radius_kneighbors(x, n_neighbors):
     return radius
 
 
-def num_points_within_radius(x, radius):
+class SortedPoints:
+    """Sorted copy of one-dimensional points, used instead of a KDTree to count
+    neighbors within a radius with binary searches"""
+
+    def __init__(self, x):
+        self.data = np.asarray(x, dtype=np.float64)
+        self.sorted = np.sort(self.data[:, 0])
+
+    def get_arrays(self):
+        return self.data, self.sorted
+
+
+def build_tree(x):
+    """Build the structure used to count neighbors of the points x: a sorted
+    copy for one-dimensional points and a Chebyshev KDTree otherwise
+
+    :param x: ndarray, shape (n_samples, n_dim)
+    :returns: SortedPoints or KDTree of x
+
+    """
+    if x.shape[1] == 1:
+        return SortedPoints(x)
+    return KDTree(x, metric="chebyshev")
+
+
+def count_sorted_within_radius(sorted_x, x, radius):
+    """For each point x[i], count the points of sorted_x with |sorted_x - x[i]| <= radius[i].
+
+    The binary searches on x -/+ radius are corrected at both ends using the
+    distances themselves, so the counts agree exactly with a KDTree query.
+
+    :param sorted_x: ndarray, shape (n_samples,), sorted
+    :param x: ndarray, shape (n_samples,)
+    :param radius: radius, shape (n_samples,)
+    :returns: number of points within radius, including the point itself
+
+    """
+    n = len(sorted_x)
+    lo = np.searchsorted(sorted_x, x - radius, side='left')
+    hi = np.searchsorted(sorted_x, x + radius, side='right')
+
+    def within(idx):
+        valid = (idx >= 0) & (idx < n)
+        dist = np.abs(sorted_x[np.clip(idx, 0, n - 1)] - x)
+        return valid & (dist <= radius)
+
+    # Move each end over whole groups of tied values until it sits exactly on
+    # the boundary of the points within radius
+    while True:
+        grow = within(lo - 1)
+        shrink = ~grow & ~within(lo) & (lo < hi)
+        if not (grow.any() or shrink.any()):
+            break
+        lo[grow] = np.searchsorted(sorted_x, sorted_x[lo[grow] - 1], side='left')
+        lo[shrink] = np.searchsorted(sorted_x, sorted_x[lo[shrink]], side='right')
+    while True:
+        grow = within(hi)
+        shrink = ~grow & ~within(hi - 1) & (hi > lo)
+        if not (grow.any() or shrink.any()):
+            break
+        hi[grow] = np.searchsorted(sorted_x, sorted_x[hi[grow]], side='right')
+        hi[shrink] = np.searchsorted(sorted_x, sorted_x[hi[shrink] - 1], side='left')
+    return hi - lo
+
+
+def num_points_within_radius(x, radius, kd=None):
     """For each point, determine the number of other points within a given radius
 
     :param x: ndarray, shape (n_samples, n_dim)
     :param radius: radius, shape (n_samples,)
+    :param kd: optional prebuilt structure of x, as returned by build_tree. Its
+        columns may be in any order, since Chebyshev distances do not depend on it
     :returns: number of points within radius
 
     """
-    kd = KDTree(x, metric="chebyshev")
-    nx = kd.query_radius(x, radius, count_only=True, return_distance=False)
+    if kd is None:
+        kd = build_tree(x)
+    if isinstance(kd, SortedPoints):
+        nx = count_sorted_within_radius(kd.sorted, kd.data[:, 0], radius)
+    else:
+        nx = kd.query_radius(np.asarray(kd.data), radius, count_only=True,
+                             return_distance=False)
     return np.array(nx) - 1.0
 
 
@@ -79,13 +152,16 @@ def add_noise(x, rng, noise_type='uniform', amplitude=1e-10):
     return x
 
 
-def compute_mi(x, y, n_neighbors=3, noise_type=None)->float:
+def compute_mi(x, y, n_neighbors=3, noise_type=None, x_tree=None,
+               y_tree=None)->float:
     """Compute mutual information between two continuous variables.
 
     :param x: real ndarray, shape (n_samples,) or (n_samples, n_features)
     :param y: real ndarray, shape (n_samples,) or (n_samples, n_features)
     :param n_neighbors: Number of nearest neighbors
     :param noise_type: add noise of given type (uniform, normal)
+    :param x_tree: optional build_tree of the preprocessed x (only without noise)
+    :param y_tree: optional build_tree of the preprocessed y (only without noise)
     :returns: non-negative estimate of mutual information
 
     """
@@ -108,15 +184,16 @@ def compute_mi(x, y, n_neighbors=3, noise_type=None)->float:
                                          return_counts=True)
             k[mask] = counts[ix] - 1
 
-    nx = num_points_within_radius(x, radius)
-    ny = num_points_within_radius(y, radius)
+    nx = num_points_within_radius(x, radius, x_tree)
+    ny = num_points_within_radius(y, radius, y_tree)
 
     mi = max(0, digamma(n_samples) + np.mean(digamma(k))
              - np.mean(digamma(nx + 1)) - np.mean(digamma(ny + 1)))
     return mi
 
 
-def compute_cmi(x, y, z, n_neighbors=3, noise_type=None):
+def compute_cmi(x, y, z, n_neighbors=3, noise_type=None, xz_tree=None,
+                yz_tree=None, z_tree=None):
     """Compute conditional mutual information I(x;y|z)
 
     :param x: real ndarray, shape (n_samples,) or (n_samples, n_features)
@@ -124,6 +201,9 @@ def compute_cmi(x, y, z, n_neighbors=3, noise_type=None):
     :param z: real ndarray, shape (n_samples,) or (n_samples, n_features)
     :param n_neighbors: Number of nearest neighbors
     :param noise_type: add noise of given type (uniform, normal)
+    :param xz_tree: optional build_tree of the preprocessed (x, z) (only without noise)
+    :param yz_tree: optional build_tree of the preprocessed (y, z) (only without noise)
+    :param z_tree: optional build_tree of the preprocessed z (only without noise)
     :returns: non-negative estimate of conditional mutual information
 
     """
@@ -147,24 +227,144 @@ def compute_cmi(x, y, z, n_neighbors=3, noise_type=None):
                                          return_counts=True)
             k[mask] = counts[ix] - 1
 
-    nxz = num_points_within_radius(np.hstack((x, z)), radius)
-    nyz = num_points_within_radius(np.hstack((y, z)), radius)
-    nz = num_points_within_radius(z, radius)
+    nxz = num_points_within_radius(np.hstack((x, z)), radius, xz_tree)
+    nyz = num_points_within_radius(np.hstack((y, z)), radius, yz_tree)
+    nz = num_points_within_radius(z, radius, z_tree)
 
     cmi = max(0, np.mean(digamma(k)) - np.mean(digamma(nxz + 1))
               - np.mean(digamma(nyz + 1)) + np.mean(digamma(nz + 1)))
     return cmi
 
 
-def compute_batch_mi(x, y, n_neighbors=3, noise_type=None):
-    N = len(x)
-    batch_size = 500
-    n_batches = N//batch_size
-    mi = np.zeros(n_batches)
+def block_starts(n_samples, block_size=500, overlap=0, n_blocks=None, seed=None):
+    """First sample of the blocks of a block estimator
+
+    :param n_samples: number of samples of the series
+    :param block_size: number of samples per block
+    :param overlap: number of samples shared by consecutive blocks
+    :param n_blocks: if given, a random subsample of this many blocks (without
+        replacement, in increasing order) instead of all the blocks
+    :param seed: seed (or SeedSequence) of the random subsample
+    :returns: integer ndarray with the start of every complete block
 
-    for i in range(n_batches):
-        i0 = i * batch_size
-        i1 = i0 + batch_size
-        mi[i] = compute_mi(x[i0:i1], y[i0:i1], n_neighbors, noise_type)
+    """
+    if not 0 <= overlap < block_size:
+        raise ValueError('overlap must be in [0, block_size)')
+    starts = np.arange(0, n_samples - block_size + 1, block_size - overlap)
+    if n_blocks is not None and n_blocks < len(starts):
+        starts = np.sort(default_rng(seed).choice(starts, n_blocks, replace=False))
+    return starts
 
-    return mi.mean()
+
+def _block_estimate(task):
+    estimator, blocks, kwargs = task
+    return estimator(*blocks, **kwargs)
+
+
+def block_estimates(estimator, variables, starts, block_size=500, workers=1,
+                    **kwargs):
+    """Evaluate an estimator on blocks of the series
+
+    :param estimator: function of the variables, e.g. compute_mi or compute_cmi
+    :param variables: list of ndarrays of shape (n_samples,) or (n_samples, n_features)
+    :param starts: first sample of every block, as returned by block_starts
+    :param block_size: number of samples per block
+    :param workers: number of worker processes, 1 evaluates the blocks serially
+    :param kwargs: keyword arguments of the estimator, e.g. n_neighbors
+    :returns: ndarray with the estimate of every block
+
+    """
+    variables = [np.asarray(v) for v in variables]
+    tasks = [(estimator, [v[start:start+block_size] for v in variables], kwargs)
+             for start in starts]
+    if workers <= 1:
+        return np.array([_block_estimate(task) for task in tasks])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(tasks)//(4*workers))
+        return np.array(list(executor.map(_block_estimate, tasks,
+                                          chunksize=chunksize)))
+
+
+def bootstrap_means(estimates, n_resamples=1000, seed=None):
+    """Bootstrap distribution of the mean of block estimates
+
+    :param estimates: ndarray of shape (n_blocks,) or (n_blocks, n_estimates)
+    :param n_resamples: number of bootstrap resamples of the blocks
+    :param seed: seed (or SeedSequence) of the resampling
+    :returns: ndarray of shape (n_resamples,) + estimates.shape[1:]
+
+    """
+    estimates = np.asarray(estimates)
+    resamples = default_rng(seed).integers(0, len(estimates),
+                                           size=(n_resamples, len(estimates)))
+    return estimates[resamples].mean(axis=1)
+
+
+def confidence_interval(samples, confidence=0.95):
+    """Percentile interval of bootstrap samples along the first axis
+
+    :returns: (low, high)
+
+    """
+    tail = 50*(1 - confidence)
+    return tuple(np.percentile(samples, [tail, 100 - tail], axis=0))
+
+
+def block_estimator(estimator, variables, block_size=500, overlap=0,
+                    n_blocks=None, seed=None, workers=1, confidence=0.95,
+                    n_resamples=1000, **kwargs):
+    """Block version of an estimator: mean of its estimates over blocks of
+    bounded size, with a bootstrap confidence interval over the blocks. Blocks
+    that overlap are not independent, so their interval is only approximate.
+    The block subsample and the bootstrap draw from independent streams
+    spawned from 'seed'.
+
+    :returns: (estimate, low, high)
+
+    """
+    subsample, resampling = np.random.SeedSequence(seed).spawn(2)
+    starts = block_starts(len(variables[0]), block_size, overlap, n_blocks,
+                          subsample)
+    if len(starts) == 0:
+        raise ValueError('series shorter than one block')
+    estimates = block_estimates(estimator, variables, starts, block_size,
+                                workers, **kwargs)
+    low, high = confidence_interval(bootstrap_means(estimates, n_resamples, resampling),
+                                    confidence)
+    return estimates.mean(), low, high
+
+
+def compute_block_mi(x, y, n_neighbors=3, noise_type=None, block_size=500,
+                     overlap=0, n_blocks=None, seed=None, workers=1,
+                     confidence=0.95, n_resamples=1000):
+    """Block estimate of the mutual information between two continuous
+    variables, see block_estimator and compute_mi
+
+    :returns: (estimate, low, high) of the mean block mutual information
+
+    """
+    return block_estimator(compute_mi, [x, y], block_size, overlap, n_blocks,
+                           seed, workers, confidence, n_resamples,
+                           n_neighbors=n_neighbors, noise_type=noise_type)
+
+
+def compute_block_cmi(x, y, z, n_neighbors=3, noise_type=None, block_size=500,
+                      overlap=0, n_blocks=None, seed=None, workers=1,
+                      confidence=0.95, n_resamples=1000):
+    """Block estimate of the conditional mutual information I(x;y|z), see
+    block_estimator and compute_cmi
+
+    :returns: (estimate, low, high) of the mean block conditional mutual information
+
+    """
+    return block_estimator(compute_cmi, [x, y, z], block_size, overlap, n_blocks,
+                           seed, workers, confidence, n_resamples,
+                           n_neighbors=n_neighbors, noise_type=noise_type)
+
+
+def compute_batch_mi(x, y, n_neighbors=3, noise_type=None):
+    """Mean mutual information over consecutive blocks of 500 samples, NaN for
+    series shorter than one block"""
+    starts = block_starts(len(x), block_size=500)
+    return block_estimates(compute_mi, [x, y], starts, 500,
+                           n_neighbors=n_neighbors, noise_type=noise_type).mean()
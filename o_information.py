@@ -0,0 +1,126 @@
+import abc
+import numpy  as np
+import pandas as pd
+from typing       import Dict
+from itertools    import combinations
+from recording    import channel_matrix
+from joint_counts import encode_channels, tuple_counts
+
+def all_ntuples(channels:list, n:int) -> list:
+    """All n-tuples (combinations) of channels, as lists."""
+    return [list(ntuple) for ntuple in combinations(channels, n)]
+
+class SubsetEntropies(abc.ABC):
+    """
+    Cache of the entropies (in bits) of subsets of channels, keyed by the sorted tuple of channel positions. Overlapping
+    tuples share most of their subsets, so every subset entropy is computed once, in batches of subsets of the same size.
+    Subclasses implement '_compute' for an array of subsets of equal size.
+    """
+    def __init__(self):
+        self.cache = {}
+
+    @abc.abstractmethod
+    def _compute(self, subsets:np.ndarray) -> np.ndarray:
+        """Entropies of an integer array of subsets of shape (n_subsets, subset_size)."""
+
+    def entropies(self, subsets:np.ndarray) -> np.ndarray:
+        """
+        Entropies of an integer array of subsets of shape (n_subsets, subset_size), computing only those not cached yet.
+        """
+        subsets = np.sort(np.asarray(subsets), axis=1)
+        keys    = list(map(tuple, subsets.tolist()))
+        missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+        if missing:
+            self.cache.update(zip(missing, self._compute(np.array(missing)).tolist()))
+        return np.array([self.cache[key] for key in keys])
+
+class GaussianEntropies(SubsetEntropies):
+    """
+    Gaussian subset entropies from log-determinants of correlation submatrices. The terms depending on the variances and on
+    the dimension cancel out in total correlation, dual total correlation and O-information, so 0.5*log2(det(R_S)) is used.
+    """
+    def __init__(self, corr:np.ndarray):
+        super().__init__()
+        self.corr = np.asarray(corr, dtype=np.float64)
+
+    def _compute(self, subsets:np.ndarray) -> np.ndarray:
+        submatrices = self.corr[subsets[:,:,np.newaxis], subsets[:,np.newaxis,:]]
+        _, logdet   = np.linalg.slogdet(submatrices)
+        return 0.5*logdet/np.log(2)
+
+class DiscreteEntropies(SubsetEntropies):
+    """
+    Plug-in entropies of subsets of integer coded channels, from the joint counts of 'joint_counts.tuple_counts'.
+    """
+    def __init__(self, codes:np.ndarray, n_symbols:int, max_cells:int=2**24):
+        super().__init__()
+        self.codes     = codes
+        self.n_symbols = n_symbols
+        self.max_cells = max_cells
+
+    def _compute(self, subsets:np.ndarray) -> np.ndarray:
+        n_samples = self.codes.shape[1]
+        per_block = max(1, self.max_cells//self.n_symbols**subsets.shape[1])
+        entropies = np.empty(len(subsets))
+        for start in range(0, len(subsets), per_block):
+            counts = tuple_counts(self.codes, subsets[start:start+per_block], self.n_symbols)
+            p      = counts.reshape(len(counts),-1)/n_samples
+            with np.errstate(divide='ignore', invalid='ignore'):
+                entropies[start:start+per_block] = -np.sum(np.where(p > 0, p*np.log2(p), 0.0), axis=1)
+        return entropies
+
+def multivariate_informations(entropies:SubsetEntropies, ntuples:np.ndarray) -> Dict[str,np.ndarray]:
+    """
+    Total correlation, dual total correlation and O-information (in bits) of many n-tuples of channels:
+        TC  = sum_i H(X_i) - H(X)
+        DTC = sum_i H(X_-i) - (n-1) H(X)
+        O   = TC - DTC
+    Parameters:
+        entropies: subset entropies estimator, shared between calls to reuse the cached subsets.
+        ntuples: integer array of shape (n_tuples, n) with the channel positions of each tuple.
+    Returns:
+        dictionary with the 'total_correlation', 'dual_total_correlation' and 'o_information' arrays of shape (n_tuples,).
+    """
+    ntuples     = np.asarray(ntuples)
+    n           = ntuples.shape[1]
+    joint       = entropies.entropies(ntuples)
+    singles     = sum(entropies.entropies(ntuples[:,[i]]) for i in range(n))
+    leave_outs  = sum(entropies.entropies(np.delete(ntuples, i, axis=1)) for i in range(n))
+    tc          = singles - joint
+    dtc         = leave_outs - (n-1)*joint
+    return {'total_correlation':tc, 'dual_total_correlation':dtc, 'o_information':tc - dtc}
+
+def informations_table(entropies:SubsetEntropies, channels:list, max_order:int=6, min_order:int=3) -> pd.DataFrame:
+    """
+    Total correlation, dual total correlation and O-information of all n-tuples of channels with min_order <= n <= max_order,
+    from a subset entropies estimator over 'channels'. Returns a data frame with one row per tuple: 'channels' (tuple of
+    names), 'order' and the three measures in bits.
+    """
+    frames = []
+    for n in range(min_order, max_order+1):
+        ntuples  = np.array(list(combinations(range(len(channels)), n)), dtype=np.intp).reshape(-1, n)
+        measures = multivariate_informations(entropies, ntuples)
+        frames.append(pd.DataFrame({'channels':[tuple(channels[i] for i in ntuple) for ntuple in ntuples], 'order':n, **measures}))
+    return pd.concat(frames, ignore_index=True)
+
+def ntuple_informations(data:pd.DataFrame, max_order:int=6, min_order:int=3, estimator:str='gaussian', n_symbols:int=None) -> pd.DataFrame:
+    """
+    Total correlation, dual total correlation and O-information of all n-tuples of channels with min_order <= n <= max_order.
+    Parameters:
+        data: data frame (or Recording) with continuous EEG channels data for the 'gaussian' estimator, or integer coded
+              (binary or symbolic) channels data for the 'discrete' estimator.
+        max_order: largest tuple size.
+        min_order: smallest tuple size.
+        estimator: 'gaussian' (log-determinants of the correlation matrix) or 'discrete' (plug-in entropies of joint counts).
+        n_symbols: size of the alphabet of discrete data, inferred from the data if None.
+    Returns:
+        data frame with one row per tuple: 'channels' (tuple of names), 'order' and the three measures in bits.
+    """
+    if estimator == 'gaussian':
+        entropies = GaussianEntropies(np.corrcoef(channel_matrix(data)))
+    elif estimator == 'discrete':
+        codes     = encode_channels(data)
+        entropies = DiscreteEntropies(codes, n_symbols or int(codes.max())+1)
+    else:
+        raise ValueError('unknown estimator ' + str(estimator))
+    return informations_table(entropies, list(data.columns), max_order, min_order)
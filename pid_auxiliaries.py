@@ -1,15 +1,28 @@
 import numpy  as np
 import pandas as pd
-from typing import Dict
-from scipy.linalg import cholesky
+from typing import Dict, Iterator
+from surrogates import CholeskySurrogates
 from mutual_info import compute_mi as mi
 from mutual_info import compute_cmi as cmi
-from scipy.stats import pearsonr
+from mutual_info import block_starts, block_estimates, bootstrap_means, confidence_interval
+from mi_cache    import KSGCache, recording_cache
+from recording   import channel_matrix, channel_rows
+from discrete_pid import window_starts
 
-def PID_continuous(s1,s2,t):
-    I1  = mi(s1,t,n_neighbors=10)
-    I2  = mi(s2,t,n_neighbors=10)
-    I12 = cmi(t,s1,s2,n_neighbors=10) + mi(t,s2,n_neighbors=10) 
+def PID_continuous(s1,s2,t, cache:KSGCache=None, names:list[str]=None):
+    """
+    Continuous PID with minimum mutual information redundancy, using KSG estimators with 10 neighbors.
+    If a KSGCache and the channel names (s1,s2,t) are given, the mutual informations and marginal trees are memoized.
+    """
+    if cache is None:
+        I1  = mi(s1,t,n_neighbors=10)
+        I2  = mi(s2,t,n_neighbors=10)
+        I12 = cmi(t,s1,s2,n_neighbors=10) + I2
+    else:
+        n1,n2,nt  = names
+        I1       = cache.mi(n1,nt,n_neighbors=10)
+        I2       = cache.mi(n2,nt,n_neighbors=10)
+        I12      = cache.cmi(nt,n1,n2,n_neighbors=10) + I2
     r   = np.min([I1,I2])
     u1  = I1-r
     u2  = I2-r
@@ -18,9 +31,10 @@ def PID_continuous(s1,s2,t):
     return results
 
 def pid_row_continuous(data: pd.DataFrame, triplet:list, results:Dict[str,list]) -> None:
-    rvs = data[triplet].to_numpy().T 
+    rvs   = channel_rows(data, triplet)
+    cache = recording_cache(data)
     def fill_row(i,j,k):
-        pid    = PID_continuous(rvs[i],rvs[j],rvs[k])
+        pid    = PID_continuous(rvs[i],rvs[j],rvs[k],cache,[triplet[i],triplet[j],triplet[k]])
         results['source1'].append(triplet[i])
         results['source2'].append(triplet[j])
         results['target'].append(triplet[k])
@@ -33,60 +47,226 @@ def pid_row_continuous(data: pd.DataFrame, triplet:list, results:Dict[str,list])
     fill_row(1,2,0)
     return 
 
-def pid_analytical(data: pd.DataFrame, triplet:list[str],  MIs:dict[frozenset[str],float], results:dict[str,list])->None:
-    triplet_permutations = [(0,1,2),(1,0,2),(2,1,0)]
-    for idx_t, idx_s1, idx_s2 in triplet_permutations:
-        #locate source with minimal mutual information with respect to the target
-        target          = triplet[idx_t]
-        sources         = [triplet[idx_s1],triplet[idx_s2]]
-        I1              = MIs[frozenset((target,sources[0]))]
-        I2              = MIs[frozenset((target,sources[1]))]
-        idx_min,idx_max = np.argsort([I1,I2])
-        source_min      = sources[idx_min]
-        source_max      = sources[idx_max]
-        #assign correlation coefficient 'a' to pair with minimal MI, 'b' to remaining pair and 'c' between sources.
-        a               = pearsonr(data[target],data[source_min]).statistic     #correlation of pair (target,source) with minimal MI
-        c               = pearsonr(data[target],data[source_max]).statistic     #correlation of remaining (target,source) pair
-        b               = pearsonr(data[source_min],data[source_max]).statistic #correlation between sources
-        a2, b2, c2      = np.square(a),np.square(b),np.square(c)
-        #compute PID assuming Gaussian random variables using as correlation matrix the sample correlation matrix
-        redundancy      = 0.5*np.log(1/(1-a2))
-        synergy         = 0.5*np.log(((1-b2)*(1-c2))/(1-(a2+b2+c2)+2*a*b*c)) 
-        results['source1'].append(sources[0])
-        results['source2'].append(sources[1])
-        results['target'].append(target)
-        results['sinergy'].append(synergy)
-        results['redundancy'].append(redundancy)
+def pid_rows_continuous(data: pd.DataFrame, triplets:list, results:Dict[str,list]) -> None:
+    for triplet in triplets:
+        pid_row_continuous(data, triplet, results)
     return
 
+# PID atoms of the continuous PID and the bounds of their confidence intervals in block mode
+CONTINUOUS_ATOMS = ['sinergy','unique1','unique2','redundancy']
+INTERVAL_KEYS    = [atom + bound for atom in CONTINUOUS_ATOMS for bound in ('_low','_high')]
+
+def pid_from_mis(I1:np.ndarray, I2:np.ndarray, I12:np.ndarray) -> Dict[str,np.ndarray]:
+    """Minimum mutual information PID atoms from I(s1;t), I(s2;t) and I(s1,s2;t), elementwise."""
+    r = np.minimum(I1, I2)
+    return {'sinergy':I12-I1-I2+r, 'unique1':I1-r, 'unique2':I2-r, 'redundancy':r}
+
+def PID_continuous_blocks(data: pd.DataFrame, names:list[str], block_size:int=500, overlap:int=0, n_blocks:int=None,
+                          seed:int=None, confidence:float=0.95, n_resamples:int=1000) -> Dict[str,float]:
+    """
+    Block version of PID_continuous: the KSG informations of (s1,s2,t) are estimated on blocks of 'block_size' samples
+    (see 'mutual_info.block_starts'), the PID is computed from their means, and a bootstrap over the blocks gives the
+    confidence interval of every atom. Pairwise block informations are memoized in the KSGCache of the recording.
+    Parameters:
+        data: data frame (or Recording) with continuous EEG channels data.
+        names: channel names of (source1, source2, target).
+        block_size, overlap, n_blocks: blocks of the estimator, see 'mutual_info.block_starts'.
+        seed: seed of the random block subsample and of the bootstrap, drawn from independent streams spawned from it.
+        confidence: level of the bootstrap intervals.
+        n_resamples: number of bootstrap resamples of the blocks.
+    Returns:
+        dictionary with the atoms (keys of CONTINUOUS_ATOMS) and the bounds of their intervals (keys of INTERVAL_KEYS).
+    """
+    n1,n2,nt = names
+    cache     = recording_cache(data)
+    subsample, resampling = np.random.SeedSequence(seed).spawn(2)
+    starts    = block_starts(len(data[nt]), block_size, overlap, n_blocks, subsample)
+    I1        = cache.block_mi(n1, nt, starts, block_size, n_neighbors=10)
+    I2        = cache.block_mi(n2, nt, starts, block_size, n_neighbors=10)
+    I12       = block_estimates(cmi, [data[nt], data[n1], data[n2]], starts, block_size, n_neighbors=10) + I2
+    blocks    = np.stack([I1, I2, I12], axis=-1)
+    results   = pid_from_mis(*blocks.mean(axis=0))
+    resampled = pid_from_mis(*bootstrap_means(blocks, n_resamples, resampling).T)
+    low,high  = confidence_interval(np.stack([resampled[atom] for atom in CONTINUOUS_ATOMS], axis=-1), confidence)
+    for n,atom in enumerate(CONTINUOUS_ATOMS):
+        results[atom + '_low']  = low[n]
+        results[atom + '_high'] = high[n]
+    return results
+
+def pid_rows_continuous_blocks(data: pd.DataFrame, triplets:list, results:Dict[str,list], block_size:int=500, overlap:int=0,
+                               n_blocks:int=None, seed:int=None, confidence:float=0.95) -> None:
+    """
+    Same rows as 'pid_rows_continuous' from the block estimator of 'PID_continuous_blocks', with the interval bounds of
+    every atom in the INTERVAL_KEYS columns. Bind the block options with functools.partial to use it with 'run_triplets'.
+    """
+    for triplet in triplets:
+        for i,j,k in [(0,1,2),(0,2,1),(1,2,0)]:
+            pid = PID_continuous_blocks(data, [triplet[i],triplet[j],triplet[k]], block_size, overlap, n_blocks, seed, confidence)
+            results['source1'].append(triplet[i])
+            results['source2'].append(triplet[j])
+            results['target'].append(triplet[k])
+            for key in CONTINUOUS_ATOMS + INTERVAL_KEYS:
+                results[key].append(pid[key])
+    return
+
+# (target, source1, source2) positions of the three permutations of a triplet in the analytical PID
+ANALYTICAL_PERMUTATIONS = [(0,1,2),(1,0,2),(2,1,0)]
+
+def gaussian_mi(r:np.ndarray) -> np.ndarray:
+    """
+    Closed-form mutual information (in nats) of two Gaussian random variables with correlation coefficient r.
+    """
+    return -0.5*np.log(1-np.square(r))
+
+def analytical_pid_from_corr(corr:np.ndarray, rows:np.ndarray, MIs:np.ndarray=None) -> Dict[str,np.ndarray]:
+    """
+    Gaussian PID with minimum mutual information redundancy, for many (target, source1, source2) rows at once.
+    Parameters:
+        corr: correlation matrix of shape (..., n_channels, n_channels). Leading axes are treated as a batch of matrices.
+        rows: integer array of shape (n_rows, 3) with the channel positions of (target, source1, source2).
+        MIs: optional array of shape (..., n_rows, 2) with the mutual informations of (target,source1) and (target,source2),
+             used to locate the source with minimal mutual information. Defaults to the closed-form Gaussian MI of 'corr'.
+    Returns:
+        dictionary with the 'sinergy' and 'redundancy' arrays of shape (..., n_rows).
+    """
+    target, source1, source2 = np.asarray(rows).T
+    r1  = corr[..., target, source1]
+    r2  = corr[..., target, source2]
+    b   = corr[..., source1, source2]                        #correlation between sources
+    if MIs is None:
+        MIs = np.stack([gaussian_mi(r1),gaussian_mi(r2)], axis=-1)
+    first_is_min = MIs[...,0] <= MIs[...,1]
+    a            = np.where(first_is_min, r1, r2)            #correlation of pair (target,source) with minimal MI
+    c            = np.where(first_is_min, r2, r1)            #correlation of remaining (target,source) pair
+    a2, b2, c2   = np.square(a),np.square(b),np.square(c)
+    redundancy   = 0.5*np.log(1/(1-a2))
+    synergy      = 0.5*np.log(((1-b2)*(1-c2))/(1-(a2+b2+c2)+2*a*b*c))
+    return {'sinergy':synergy, 'redundancy':redundancy}
+
+def analytical_rows(channels:list[str], triplets:list) -> np.ndarray:
+    """
+    Channel positions (target, source1, source2) of the permutations of every triplet, in the order of ANALYTICAL_PERMUTATIONS.
+    """
+    position = {channel:i for i,channel in enumerate(channels)}
+    return np.array([[position[triplet[i]] for i in permutation] for triplet in triplets for permutation in ANALYTICAL_PERMUTATIONS])
+
+def pid_analytical_rows(data: pd.DataFrame, triplets:list, results:dict[str,list], MIs:dict[frozenset[str],float]=None,
+                        corr:np.ndarray=None) -> None:
+    """
+    Gaussian PID of the permutations of all triplets, from a single sample correlation matrix.
+    Parameters:
+        data: data frame with continuous EEG channels data.
+        triplets: list of triplets of channel names.
+        results: dictionary of lists where the rows are appended.
+        MIs: mutual information of each pair of channels used to rank the sources (e.g. KSG estimates).
+             If None, the sources are ranked with the closed-form Gaussian MI -0.5*log(1-r^2).
+        corr: correlation matrix of the channels of 'data' if already known, computed from 'data' if None.
+    """
+    channels = list(data.columns)
+    corr     = np.corrcoef(channel_matrix(data)) if corr is None else corr
+    rows     = analytical_rows(channels, triplets)
+    names    = np.array(channels)[rows]
+    if MIs is not None:
+        MIs = np.array([[MIs[frozenset((t,s1))],MIs[frozenset((t,s2))]] for t,s1,s2 in names])
+    pid = analytical_pid_from_corr(corr, rows, MIs)
+    results['source1'].extend(names[:,1].tolist())
+    results['source2'].extend(names[:,2].tolist())
+    results['target'].extend(names[:,0].tolist())
+    results['sinergy'].extend(pid['sinergy'])
+    results['redundancy'].extend(pid['redundancy'])
+    return
+
+def sliding_window_corr(series:np.ndarray, size:int, step:int) -> Iterator[np.ndarray]:
+    """
+    Correlation matrices of the channels over a sliding window, from running sums and cross-products updated incrementally:
+    when the window moves, the samples leaving it are subtracted and those entering it added, so every step costs
+    O(step*n_channels^2) instead of O(size*n_channels^2). The series are centered on their global mean beforehand to keep the
+    running sums well conditioned.
+    Parameters:
+        series: array of shape (n_channels, n_samples).
+        size: number of samples per window.
+        step: number of samples the window moves at each step.
+    Returns:
+        iterator over arrays of shape (n_channels, n_channels), one per window of 'window_starts'.
+    """
+    series  = np.asarray(series, dtype=np.float64)
+    series  = series - series.mean(axis=1, keepdims=True)
+    sums    = None
+    for start in window_starts(series.shape[1], size, step):
+        if sums is None or step >= size:
+            window   = series[:,start:start+size]
+            sums     = window.sum(axis=1)
+            products = window @ window.T
+        else:
+            leaving, entering = series[:,start-step:start], series[:,start+size-step:start+size]
+            sums     += entering.sum(axis=1) - leaving.sum(axis=1)
+            products += entering @ entering.T - leaving @ leaving.T
+        covariance = products - np.outer(sums, sums)/size
+        scale      = np.sqrt(np.diag(covariance))
+        yield covariance/np.outer(scale, scale)
+
+def sliding_window_analytical_pid(data: pd.DataFrame, triplets:list, size:int, step:int) -> Dict[str,np.ndarray]:
+    """
+    Time-resolved Gaussian PID of the permutations of all triplets, from correlation matrices maintained incrementally as
+    the window moves. The sources are ranked with the closed-form Gaussian MI of each window.
+    Parameters:
+        data: data frame (or Recording) with continuous EEG channels data.
+        triplets: list of triplets of channel names.
+        size: number of samples per window.
+        step: number of samples the window moves at each step.
+    Returns:
+        dictionary with the 'sinergy' and 'redundancy' arrays of shape (n_windows, n_triplets, 3), with the permutations of
+        each triplet in the order of ANALYTICAL_PERMUTATIONS.
+    """
+    rows = analytical_rows(list(data.columns), triplets)
+    corr = np.stack(list(sliding_window_corr(channel_matrix(data), size, step)))
+    pid  = analytical_pid_from_corr(corr, rows)
+    return {key:values.reshape(len(corr), len(triplets), len(ANALYTICAL_PERMUTATIONS)) for key,values in pid.items()}
+
+def analytical_surrogate_pid(surrogates:CholeskySurrogates, triplets:list, n_surrogates:int, start:int=0,
+                             batch_size:int=1024) -> Iterator[Dict[str,np.ndarray]]:
+    """
+    Gaussian PID of the permutations of all triplets under the null of Cholesky surrogates, from sample correlation
+    matrices drawn directly from their Wishart distribution (see 'CholeskySurrogates.correlations'), so no surrogate time
+    series are generated. The sources are ranked with the closed-form Gaussian MI of each surrogate.
+    Parameters:
+        surrogates: CholeskySurrogates of the recording.
+        triplets: list of triplets of channel names.
+        n_surrogates: number of null draws.
+        start: index of the first draw.
+        batch_size: number of correlation matrices drawn and analysed at once.
+    Returns:
+        iterator over dictionaries with the 'sinergy' and 'redundancy' arrays of shape (batch, n_rows), with the rows in the
+        order of 'analytical_rows' (as in 'pid_analytical_rows').
+    """
+    rows = analytical_rows(surrogates.columns, triplets)
+    stop = start + n_surrogates
+    for batch_start in range(start, stop, batch_size):
+        yield analytical_pid_from_corr(surrogates.correlations(batch_start, min(batch_size, stop-batch_start)), rows)
+
+def pid_analytical(data: pd.DataFrame, triplet:list[str],  MIs:dict[frozenset[str],float], results:dict[str,list])->None:
+    pid_analytical_rows(data[triplet], [triplet], results, MIs)
+    return
 
-def compute_and_store_analytical_results(data_df:pd.DataFrame, left_triplets:list, right_triplets:list, left_MIs:Dict[frozenset[str],float], right_MIs:Dict[frozenset[str],float], results:dict, path:str)-> None:
-    for triplet in left_triplets:
-       pid_analytical(data_df, triplet, left_MIs,results)
 
-    for triplet in right_triplets:
-       pid_analytical(data_df, triplet, right_MIs,results)    
-    pd.DataFrame(results).to_csv(path)    
+def compute_and_store_analytical_results(data_df:pd.DataFrame, left_triplets:list, right_triplets:list, left_MIs:Dict[frozenset[str],float], right_MIs:Dict[frozenset[str],float], results:dict, path:str,
+                                         writer=None)-> None:
+    MIs = None if left_MIs is None or right_MIs is None else {**left_MIs, **right_MIs}
+    pid_analytical_rows(data_df, left_triplets + right_triplets, results, MIs)
+    if writer is None:
+        pd.DataFrame(results).to_csv(path)
+    else:                                   # a prefetch.AsyncWriter
+        writer.submit(pd.DataFrame(results).to_csv, path)
 
 
-def generate_surrogates(data_df:pd.DataFrame) -> pd.DataFrame:
+def generate_surrogates(data_df:pd.DataFrame, seed:int=None) -> pd.DataFrame:
     """
     Creates a sample of surrogate data via Cholesky decomposition.
     Parameters:
         data_df: a dataframe containing the empirical EEG data
+        seed: optional seed of the random stream
     Returns:
         surrogate_df: a dataframe containing the surrogate EEG data
     """
-    def gaussian_cholesky_surrogates(series):
-        pearson_corr  = np.corrcoef(series)
-        x             = np.random.normal(size=series.shape)
-        c             = cholesky(pearson_corr, lower=True)
-        choles        = np.dot(c, x)
-        return choles   
-    def random_permutation_surrogates(series):
-        rng   = np.random.default_rng()
-        return rng.permuted(series, axis=1)
-    data_array      = data_df.to_numpy()
-    surrogate_array = gaussian_cholesky_surrogates(data_array.T)
-    surrogate_df    = pd.DataFrame(surrogate_array.T,columns=data_df.columns)
-    return surrogate_df
+    surrogates = CholeskySurrogates(data_df, seed)
+    return surrogates.frame(surrogates.surrogate(0))
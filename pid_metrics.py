@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import heapq
+import cProfile
+import resource
+import threading
+import pandas as pd
+from contextlib  import contextmanager
+from collections import defaultdict
+from recording   import Recording
+
+# metrics of the run in progress in this process, None disables recording
+_active = None
+
+def peak_rss_mb(who:int=resource.RUSAGE_SELF) -> float:
+    """Peak resident set size in MB (ru_maxrss is in kB on Linux)."""
+    return resource.getrusage(who).ru_maxrss/1024
+
+class RunMetrics:
+    """
+    Per-stage metrics of one run (e.g. one subject, stage and mode), appended as JSON lines to 'path': wall and CPU time of
+    every stage, CPU time of worker processes, peak RSS and any extra fields of the stage (e.g. triplets and triplets/sec).
+    With 'profile_slowest' > 0, the timings of the triplet chunks seen by 'triplet_scheduler.run_triplets' are kept, and the
+    slowest chunks of the whole run are profiled again with cProfile in this process when the run is closed, their stats
+    saved as '<path>.slowest<rank>.prof'. The data of these chunks is held until then.
+    Only the stages of the thread that opened the run are recorded, not those of background threads (see 'prefetch').
+    """
+    def __init__(self, path:str, profile_slowest:int=0, **context):
+        self.path            = path
+        self.context         = context
+        self.profile_slowest = profile_slowest
+        self.slowest         = []                    # min-heap of (seconds, order, triplets, rows_function, data)
+        self.order           = 0
+        self.triplets        = 0
+        self.file            = open(path, 'a')
+        self.thread          = threading.get_ident()
+
+    def record(self, stage:str, wall:float, cpu:float, cpu_children:float=0.0, **fields) -> None:
+        entry = {**self.context, 'stage':stage, 'time':time.strftime('%Y-%m-%dT%H:%M:%S'), 'wall_s':wall, 'cpu_s':cpu,
+                 'cpu_children_s':cpu_children, 'peak_rss_mb':peak_rss_mb(), 'peak_rss_children_mb':peak_rss_mb(resource.RUSAGE_CHILDREN), **fields}
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        if stage == 'pid':
+            self.triplets += fields.get('triplets', 0)
+
+    def chunk_times(self, rows_function, data, chunks:list, seconds:list) -> None:
+        """
+        Keeps the timings of the 'profile_slowest' slowest chunks of triplets of the run, with what is needed to profile
+        them when the run is closed. Nothing is profiled here, so the timings of the run are those of an unprofiled run.
+        """
+        if self.profile_slowest <= 0:
+            return
+        for chunk, chunk_seconds in zip(chunks, seconds):
+            if len(self.slowest) == self.profile_slowest and chunk_seconds <= self.slowest[0][0]:
+                continue
+            entry = (chunk_seconds, self.order, chunk, rows_function, data)
+            self.order += 1
+            if len(self.slowest) < self.profile_slowest:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heapreplace(self.slowest, entry)
+
+    def profile_chunks(self) -> None:
+        """
+        Profiles the slowest chunks of the run once each, slowest first. Chunks are re-run on a fresh view of the data, so
+        memoized estimates (see 'mi_cache') are recomputed in the profile.
+        """
+        ranked = sorted(self.slowest, key=lambda entry: -entry[0])
+        chunks = []
+        for rank, (seconds, _, chunk, rows_function, data) in enumerate(ranked):
+            profile = cProfile.Profile()
+            profile.runcall(rows_function, fresh_view(data), chunk, defaultdict(list))
+            profile.dump_stats(self.path + '.slowest' + str(rank) + '.prof')
+            chunks.append({'seconds':seconds, 'triplets':chunk, 'profile':self.path + '.slowest' + str(rank) + '.prof'})
+        self.slowest = []
+        self.file.write(json.dumps({**self.context, 'stage':'slowest_triplets', 'chunks':chunks}) + '\n')
+
+    def close(self) -> None:
+        if self.slowest:
+            self.profile_chunks()
+        self.file.close()
+
+def fresh_view(data):
+    """Same data under a new object, so per-object caches start empty."""
+    return Recording(data.data, data.channels) if isinstance(data, Recording) else pd.DataFrame(data, copy=False)
+
+def active() -> RunMetrics:
+    return _active
+
+def detach() -> None:
+    """
+    Stops recording in this process without closing the active run. Used by forked worker processes, which inherit the run
+    of their parent: their work is timed by the parent, and the thread filter of 'stage' does not tell them apart.
+    """
+    global _active
+    _active = None
+
+@contextmanager
+def metrics_run(path:str, profile_slowest:int=0, **context):
+    """
+    Records the stages of the code run inside the block to the JSON lines file 'path'. 'context' fields (e.g. subject,
+    stage, mode) are added to every line. A final 'run' line holds the totals, with the triplets/sec of the whole run.
+    """
+    global _active
+    previous = _active
+    _active  = RunMetrics(path, profile_slowest, **context)
+    try:
+        with stage('run') as fields:
+            yield _active
+            fields['triplets'] = _active.triplets
+    finally:
+        _active.close()
+        _active = previous
+
+@contextmanager
+def stage(name:str, **fields):
+    """
+    Measures the wall and CPU time of the code inside the block as stage 'name' of the active run, if any.
+    The yielded dictionary can be filled with extra fields, e.g. the number of triplets processed.
+    """
+    wall, cpu, children = time.perf_counter(), time.process_time(), os.times()
+    yield fields
+    if _active is not None and _active.thread == threading.get_ident():
+        elapsed = time.perf_counter() - wall
+        now     = os.times()
+        if 'triplets' in fields and elapsed > 0:
+            fields['triplets_per_sec'] = fields['triplets']/elapsed
+        _active.record(name, elapsed, time.process_time() - cpu,
+                       (now.children_user - children.children_user) + (now.children_system - children.children_system), **fields)
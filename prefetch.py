@@ -0,0 +1,113 @@
+import os
+import numpy as np
+import queue
+import threading
+from collections        import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools          import islice
+from typing             import Callable, Iterable, Iterator
+from recording          import Recording, as_recording
+from brain_data_reader  import load_useful_data
+from pid_metrics        import stage
+
+def prefetch(load:Callable, items:Iterable, depth:int=1) -> Iterator[tuple]:
+    """
+    Producer/consumer pipeline over 'items': a background thread runs 'load' on up to 'depth' items ahead of the one being
+    consumed, so loading the next items overlaps with the processing of the current one.
+    Parameters:
+        load: function of one item, e.g. reading and resampling the recording of a subject.
+        items: items to load, in order.
+        depth: number of items loaded ahead, the memory held is that of depth+1 loaded items.
+    Returns:
+        iterator of (item, future) in the order of 'items', the future holding the result (or error) of 'load(item)'.
+        Loads not started yet are cancelled if the iteration is stopped early.
+    """
+    items   = iter(items)
+    pending = deque()
+    loader  = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+    try:
+        for item in islice(items, depth+1):
+            pending.append((item, loader.submit(load, item)))
+        while pending:
+            yield pending.popleft()
+            for item in islice(items, 1):
+                pending.append((item, loader.submit(load, item)))
+    finally:
+        loader.shutdown(wait=True, cancel_futures=True)
+
+def prefetched(future:Future) -> Recording:
+    """Result of a prefetched load, timing the wait for it as stage 'prefetch_wait' of the active run (see 'pid_metrics')."""
+    with stage('prefetch_wait'):
+        return future.result()
+
+def subject_recordings(subject_IDs:list, stageid:str, data_folder:str, cache_folder:str=None, depth:int=1,
+                       dtype=np.float32) -> Iterator[tuple]:
+    """
+    (ID, future) of the useful data of every subject of an 'ari' stage, as a Recording of 'dtype' loaded 'depth' subjects
+    ahead in a background thread (see 'prefetch'). With depth 0 nothing is loaded ahead and the futures are None, so each script
+    loads its recording itself as before.
+    """
+    if depth <= 0:
+        for ID in subject_IDs:
+            yield ID, None
+        return
+    stage_name = "rest" if stageid == "1" else "task"
+    load       = lambda ID: as_recording(load_useful_data(os.path.join(data_folder, "Subject" + str(ID) + "_" + stageid + ".edf"),
+                                                          dataset='ari', stage=stage_name, cache_dir=cache_folder), dtype)
+    yield from prefetch(load, subject_IDs, depth)
+
+class AsyncWriter:
+    """
+    Writes results in a background thread, in the order they are submitted, so that storing the results of a subject
+    overlaps with the computations of the next one. At most 'max_pending' writes wait in the queue: submitting more blocks
+    until the oldest one is done, which bounds the memory held by results not written yet.
+    The first error of a write is raised again by the next 'submit' or by 'close'. Use it as a context manager so every
+    write is flushed before leaving the block.
+    """
+    def __init__(self, max_pending:int=2):
+        self.queue  = queue.Queue(maxsize=max_pending)
+        self.error  = None
+        self.thread = threading.Thread(target=self._run, name='async-writer')
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            function, args, kwargs = task
+            if self.error is None:
+                try:
+                    function(*args, **kwargs)
+                except Exception as error:
+                    self.error = error
+
+    def _raise(self) -> None:
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, function:Callable, *args, **kwargs) -> None:
+        """Queues the call function(*args, **kwargs), e.g. submit(frame.to_csv, path)."""
+        self._raise()
+        self.queue.put((function, args, kwargs))
+
+    def close(self) -> None:
+        """Waits for every queued write to be done."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_csv(frame, path:str, writer:AsyncWriter=None, **kwargs) -> None:
+    """frame.to_csv(path) now, or in the background when a writer is given."""
+    if writer is None:
+        frame.to_csv(path, **kwargs)
+    else:
+        writer.submit(frame.to_csv, path, **kwargs)
@@ -0,0 +1,59 @@
+import numpy  as np
+import pandas as pd
+from typing import Union
+
+class Recording:
+    """
+    Lightweight EEG recording: a contiguous channel-major matrix (float32 for continuous data by default, float64 for the
+    continuous and analytical PID, whose estimates move by ~1e-5 in float32; uint8 for discretized data) and a map from
+    channel names to rows. It supports the small part of the DataFrame interface used by the PID pipeline
+    (columns, indexing by channel name or list of names, to_numpy), and single channels are returned as views without copies.
+    """
+    __slots__ = ('data', 'channels', 'index', '__weakref__')
+
+    def __init__(self, data:np.ndarray, channels:list[str]):
+        self.data     = np.ascontiguousarray(data)
+        self.channels = list(channels)
+        self.index    = {channel:i for i,channel in enumerate(self.channels)}
+
+    @classmethod
+    def from_frame(cls, data_df:pd.DataFrame, dtype=np.float32) -> 'Recording':
+        return cls(data_df.to_numpy(dtype=dtype).T, data_df.columns)
+
+    @property
+    def columns(self) -> list[str]:
+        return self.channels
+
+    @property
+    def n_samples(self) -> int:
+        return self.data.shape[1]
+
+    def __len__(self) -> int:
+        return self.n_samples
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.data[self.index[key]]
+        return Recording(self.data[[self.index[channel] for channel in key]], key)
+
+    def rows(self, channels:list[str]) -> list[np.ndarray]:
+        """Views of the rows of the given channels."""
+        return [self.data[self.index[channel]] for channel in channels]
+
+    def to_numpy(self) -> np.ndarray:
+        """Samples x channels view, as DataFrame.to_numpy."""
+        return self.data.T
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.data.T, columns=self.channels, copy=False)
+
+def as_recording(data:Union[pd.DataFrame,Recording], dtype=np.float32) -> Recording:
+    return data if isinstance(data, Recording) else Recording.from_frame(data, dtype)
+
+def channel_matrix(data:Union[pd.DataFrame,Recording]) -> np.ndarray:
+    """Channel-major (n_channels, n_samples) array of a data frame or recording, without copies for recordings."""
+    return data.data if isinstance(data, Recording) else data.to_numpy().T
+
+def channel_rows(data:Union[pd.DataFrame,Recording], channels:list[str]):
+    """Observations of each of the given channels, indexable by position, without copies for recordings."""
+    return data.rows(channels) if isinstance(data, Recording) else data[channels].to_numpy().T
@@ -0,0 +1,106 @@
+import os
+import numpy   as np
+import pandas  as pd
+import pyarrow as pa
+from brain_data_reader import atomic_write
+
+# result columns holding channel names, stored as dictionary codes
+CHANNEL_KEYS = ('source1', 'source2', 'source3', 'target')
+
+def iter_batches(path:str):
+    """
+    Lazily yields the complete record batches of an Arrow IPC stream file, stopping at a last batch cut short by a crash.
+    """
+    with open(path, 'rb') as source:
+        try:
+            reader = pa.ipc.open_stream(source)
+        except (pa.ArrowInvalid, OSError):          # empty file, or schema not written yet
+            return
+        while True:
+            try:
+                yield reader.read_next_batch()
+            except StopIteration:
+                break
+            except (pa.ArrowInvalid, OSError):
+                break
+
+def read_batches(path:str) -> list:
+    """
+    Complete record batches of an Arrow IPC stream file, ignoring a last batch cut short by a crash.
+    """
+    return list(iter_batches(path))
+
+def read_results(path:str) -> pd.DataFrame:
+    """
+    Loads a results file written by ResultSink as a data frame, with channel names as categoricals.
+    """
+    batches = read_batches(path)
+    if not batches:
+        return pd.DataFrame()
+    return pa.Table.from_batches(batches).to_pandas()
+
+class ResultSink:
+    """
+    Streams PID results to an Arrow IPC stream file, one zstd-compressed record batch per write: channel names are dictionary
+    codes of a fixed list of channels, atoms are float32, and a 'surrogate' column holds the surrogate index, so all the
+    surrogates of a subject go to a single file. Every batch is flushed to disk when written, and a file cut short by a crash
+    stays readable up to its last complete batch. An existing file is reopened keeping its first 'rows' rows (every complete
+    batch if None) and new batches are appended after them.
+    """
+    def __init__(self, path:str, channels:list, keys:list, rows:int=None):
+        self.path       = path
+        self.keys       = list(keys)
+        self.dictionary = pa.array(list(channels), pa.string())
+        self.codes      = {channel:code for code,channel in enumerate(channels)}
+        self.schema     = pa.schema([pa.field('surrogate', pa.int32())] +
+                                    [pa.field(key, pa.dictionary(pa.int8(), pa.string()) if key in CHANNEL_KEYS else pa.float32()) for key in self.keys])
+        recovered       = read_batches(path) if os.path.exists(path) else []
+        if rows is not None:
+            recovered = pa.Table.from_batches(recovered, self.schema).slice(0, rows).to_batches() if recovered else []
+        # recovered rows are rewritten to a new stream in a unique temporary file, which then replaces the old file; the
+        # stream writes through a duplicate of its descriptor, so it stays open for appending once the file is published
+        self.rows = 0
+        atomic_write(path, lambda file: self._open(os.dup(file.fileno()), recovered))
+
+    def _open(self, descriptor:int, recovered:list) -> None:
+        self.file   = os.fdopen(descriptor, 'wb')
+        self.writer = pa.ipc.new_stream(self.file, self.schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+        for batch in recovered:
+            self.writer.write_batch(batch)
+            self.rows += batch.num_rows
+        self.flush()
+
+    def flush(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write(self, results:dict, surrogate:int=-1) -> int:
+        """
+        Appends the rows of a results dictionary as one record batch and returns the number of rows in the file.
+        Parameters:
+            results: dictionary of lists with the columns of the sink.
+            surrogate: index of the surrogate the rows come from, -1 for the original data.
+        """
+        n_rows  = len(results[self.keys[0]])
+        columns = [pa.array(np.full(n_rows, surrogate, dtype=np.int32))]
+        for key in self.keys:
+            if key in CHANNEL_KEYS:
+                codes = np.fromiter((self.codes[channel] for channel in results[key]), dtype=np.int8, count=n_rows)
+                columns.append(pa.DictionaryArray.from_arrays(pa.array(codes), self.dictionary))
+            else:
+                columns.append(pa.array(np.asarray(results[key], dtype=np.float32)))
+        self.writer.write_batch(pa.record_batch(columns, schema=self.schema))
+        self.flush()
+        self.rows += n_rows
+        return self.rows
+
+    def close(self) -> None:
+        self.writer.close()
+        self.flush()
+        self.file.close()
+
+    def __enter__(self) -> 'ResultSink':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
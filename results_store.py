@@ -0,0 +1,243 @@
+import os
+import re
+import time
+import sqlite3
+import argparse
+import numpy  as np
+import pandas as pd
+from typing            import Union
+from brain_data_reader import get_file_paths_from_config
+
+# columns identifying the rows of a results table, every other numeric column is stored as a REAL value column
+KEY_COLUMNS     = ['subject','stage','mode','band','source1','source2','source3','target']
+CHANNEL_COLUMNS = ['source1','source2','source3','target']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pid (subject INTEGER NOT NULL, stage TEXT NOT NULL, mode TEXT NOT NULL, band TEXT NOT NULL DEFAULT '',
+                                source1 TEXT, source2 TEXT, source3 TEXT, target TEXT, channels TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS pid_rows     ON pid (subject, stage, mode, band, source1, source2, target);
+CREATE INDEX IF NOT EXISTS pid_channels ON pid (channels, stage, mode, band, subject);
+CREATE INDEX IF NOT EXISTS pid_subjects ON pid (stage, mode, band, subject);
+CREATE INDEX IF NOT EXISTS pid_sources  ON pid (source1, source2, target, stage, mode, band, subject);
+"""
+
+# result files of the PID scripts: (pattern of the file name, mode when the pattern has no 'mode' group)
+FILE_PATTERNS = [(re.compile(r'Subject(?P<subject>\d+)_PID_(?P<stage>rest|task)_128Hz\.csv$'), 'binary'),
+                 (re.compile(r'Subject(?P<subject>\d+)_PID_(?P<stage>rest|task)_128Hz_NonBinary_5symbols\.csv$'), 'nonbinary'),
+                 (re.compile(r'Subject(?P<subject>\d+)_PID_(?P<stage>rest|task)_128Hz_continuous_(?P<mode>analytical(_ksg|_gaussian)?)\.csv$'), None),
+                 (re.compile(r'Subject(?P<subject>\d+)_PID_(?P<stage>rest|task)_128Hz_(?P<mode>continuous(_blocks\d+)?|quadruplets)\.csv$'), None),
+                 (re.compile(r'Subject(?P<subject>\d+)_(?P<stage>rest|task)_(?P<band>[A-Za-z0-9]+)_(?P<mode>binary|nonbinary|ordinal|continuous|analytical)\.csv$'), None)]
+
+def quoted(name:str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def channel_name(channel:str) -> str:
+    """Full name of an EEG channel given by its short name, e.g. 'EEG Fp1' for 'Fp1'."""
+    return channel if channel.startswith('EEG ') else 'EEG ' + channel
+
+def channels_key(channels) -> str:
+    """Sorted channel names of a row joined by commas, the same for every permutation of its sources and target."""
+    return ','.join(sorted(channel for channel in channels if isinstance(channel, str)))
+
+class ResultsStore:
+    """
+    Local SQLite store of the PID results of every subject, stage, mode and band, one row per line of the results CSVs
+    with the atoms (and any other numeric column, e.g. interval bounds) as REAL columns added when first written.
+    Rows are indexed on (subject, stage, mode, band, source1, source2, target), on their sorted channels and on (stage,
+    mode, band, subject), so that the rows of one subject, all the permutations of a triplet across subjects or one atom
+    of every subject are index lookups instead of scans of CSVs.
+    Broadband results have band ''. The database is in WAL mode, so several processes (see 'batch_runner') can write
+    to it while notebooks read it.
+    """
+    def __init__(self, path:str, timeout:float=60.0):
+        self.path       = path
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.columns    = self._columns()
+
+    def _columns(self) -> list:
+        return [row[1] for row in self.connection.execute('PRAGMA table_info(pid)')]
+
+    def value_columns(self) -> list:
+        return [column for column in self.columns if column not in KEY_COLUMNS + ['channels']]
+
+    def write(self, results:Union[dict,pd.DataFrame], subject:int, stage:str, mode:str, band:str='') -> int:
+        """
+        Stores the results of one subject, stage, mode and band, replacing the ones stored before.
+        Parameters:
+            results: results dictionary or data frame with the channel columns and numeric value columns.
+        Returns:
+            number of rows stored.
+        """
+        frame    = pd.DataFrame(results).reset_index(drop=True)
+        channels = [column for column in CHANNEL_COLUMNS if column in frame.columns]
+        values   = [column for column in frame.columns if column not in KEY_COLUMNS and pd.api.types.is_numeric_dtype(frame[column])]
+        columns  = ['subject','stage','mode','band','channels'] + channels + values
+        rows     = [(int(subject), stage, mode, band, channels_key(row[:len(channels)])) + tuple(row)
+                    for row in zip(*[frame[column].tolist() for column in channels],
+                                   *[frame[column].astype(float).tolist() for column in values])]
+        self.connection.execute('BEGIN IMMEDIATE')    # serializes writers, including the columns added below
+        try:
+            self.columns = self._columns()
+            for column in values:
+                if column not in self.columns:
+                    self.connection.execute('ALTER TABLE pid ADD COLUMN ' + quoted(column) + ' REAL')
+                    self.columns.append(column)
+            self.connection.execute('DELETE FROM pid WHERE subject=? AND stage=? AND mode=? AND band=?', (int(subject), stage, mode, band))
+            self.connection.executemany('INSERT INTO pid (' + ','.join(map(quoted, columns)) + ') VALUES (' + ','.join('?'*len(columns)) + ')', rows)
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def select(self, subject=None, stage:str=None, mode:str=None, band:str='', channels:str=None, sources:tuple=None,
+               columns:list=None) -> pd.DataFrame:
+        """
+        Rows matching every given key, ordered by subject and in the order they were written. A list of subjects selects
+        any of them, 'channels' selects the rows of one set of channels (see 'channels_key') and 'sources' the triplet rows
+        whose source1, source2 and target are the three given channels in any order, through the 'pid_sources' index. Only the given columns are read if any, otherwise value columns empty
+        in all the rows (e.g. the atoms of other modes) are dropped.
+        """
+        conditions, parameters = [], []
+        for column, value in (('subject',subject), ('stage',stage), ('mode',mode), ('band',band), ('channels',channels)):
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, range, np.ndarray)):
+                conditions.append(column + ' IN (' + ','.join('?'*len(value)) + ')')
+                parameters.extend(int(item) if column == 'subject' else item for item in value)
+            else:
+                conditions.append(column + '=?')
+                parameters.append(int(value) if column == 'subject' else value)
+        if sources is not None:
+            marks = ','.join('?'*len(sources))
+            conditions.append('source1 IN (' + marks + ') AND source2 IN (' + marks + ') AND target IN (' + marks + ') AND '
+                              'source1 <> source2 AND source1 <> target AND source2 <> target AND source3 IS NULL')
+            parameters.extend(list(sources)*3)
+        names = '*' if columns is None else ','.join(map(quoted, columns))
+        query = 'SELECT ' + names + ' FROM pid' + (' WHERE ' + ' AND '.join(conditions) if conditions else '') + ' ORDER BY subject, rowid'
+        frame = pd.read_sql_query(query, self.connection, params=parameters)
+        if columns is not None:
+            return frame
+        empty = [column for column in ['source3'] + self.value_columns() if column in frame.columns and frame[column].isna().all()]
+        return frame.drop(columns=empty + ['channels'])
+
+    def frame(self, subject:int, stage:str, mode:str, band:str='') -> pd.DataFrame:
+        """Results of one subject, stage, mode and band as in their CSV file."""
+        return self.select(subject, stage, mode, band).drop(columns=['subject','stage','mode','band'])
+
+    def subjects(self, stage:str=None, mode:str=None, band:str='') -> list:
+        conditions = [(column, value) for column, value in (('stage',stage), ('mode',mode), ('band',band)) if value is not None]
+        query      = 'SELECT DISTINCT subject FROM pid' + (' WHERE ' + ' AND '.join(column + '=?' for column, _ in conditions) if conditions else '')
+        return sorted(row[0] for row in self.connection.execute(query, [value for _, value in conditions]))
+
+    def triplet_pid(self, channels:list, subject=None, stage:str=None, mode:str=None, band:str='') -> pd.DataFrame:
+        """Rows of every permutation of the given channels (as the 'triplet_pid' helper of the notebooks), for any subject by default."""
+        return self.select(subject, stage, mode, band, channels=channels_key(channels))
+
+    def find_triplet(self, c1:str, c2:str, c3:str, subject=None, stage:str=None, mode:str=None, band:str='') -> pd.DataFrame:
+        """
+        Rows of every permutation of the triplet c1, c2, c3 as the 'find_triplet' helper of the notebooks, by full ('EEG Fp1')
+        or short ('Fp1') channel names.
+        """
+        return self.select(subject, stage, mode, band, sources=tuple(channel_name(channel) for channel in (c1, c2, c3)))
+
+    def atom_matrix(self, atom:str, stage:str, mode:str, band:str='', subjects:list=None) -> pd.DataFrame:
+        """
+        Values of one atom with a row per subject and a column per result row (source1, source2, [source3,] target), in
+        the order of the results, as the (subjects, triplets) arrays built in the notebooks.
+        """
+        frame    = self.select(subjects, stage, mode, band, columns=['subject'] + CHANNEL_COLUMNS + [atom])
+        channels = [column for column in CHANNEL_COLUMNS if frame[column].notna().any()]
+        counts   = frame.subject.value_counts(sort=False)
+        if counts.nunique() > 1:
+            raise ValueError('subjects with different result rows in ' + stage + ' ' + mode + ' ' + band)
+        first    = frame[frame.subject == counts.index[0]] if len(frame) else frame
+        columns  = pd.MultiIndex.from_frame(first[channels]) if len(channels) > 1 else pd.Index(first[channels[0]] if channels else [])
+        return pd.DataFrame(frame[atom].to_numpy().reshape(len(counts), -1), index=pd.Index(counts.index, name='subject'), columns=columns)
+
+    def subject_asymmetry(self, subject:int, atom:str='sinergy', mode:str='binary', band:str='') -> pd.DataFrame:
+        """One row per result row of a subject with the atom at rest and at task and their 'difference' (task - rest)."""
+        rest = self.frame(subject, 'rest', mode, band)
+        task = self.frame(subject, 'task', mode, band)
+        keys = [column for column in CHANNEL_COLUMNS if column in rest.columns]
+        rest = rest.assign(occurrence=rest.groupby(keys).cumcount())    # the midline triplet is in both hemispheres
+        task = task.assign(occurrence=task.groupby(keys).cumcount())
+        pair = rest[keys + ['occurrence', atom]].merge(task[keys + ['occurrence', atom]], on=keys + ['occurrence'], suffixes=('_rest','_task'))
+        pair = pair.drop(columns='occurrence').rename(columns={atom + '_rest':'rest', atom + '_task':'task'})
+        pair['difference'] = pair.task - pair.rest
+        return pair
+
+    def topography(self, atom:str='sinergy', mode:str='binary', band:str='', subjects:list=None) -> pd.DataFrame:
+        """
+        Robust Glass's delta of every result row across subjects, (median at task - median at rest)/IQR at rest, with the
+        medians and the IQR, sorted by delta (as the effect sizes of the topography plots of the notebooks).
+        """
+        rest  = self.atom_matrix(atom, 'rest', mode, band, subjects)
+        task  = self.atom_matrix(atom, 'task', mode, band, subjects).reindex(index=rest.index, columns=rest.columns)
+        q1,q3 = np.nanpercentile(rest.to_numpy(), [25, 75], axis=0)
+        table = rest.columns.to_frame(index=False)
+        table['median_rest'] = np.nanmedian(rest.to_numpy(), axis=0)
+        table['median_task'] = np.nanmedian(task.to_numpy(), axis=0)
+        table['iqr_rest']    = q3 - q1
+        table['delta']       = (table.median_task - table.median_rest)/table.iqr_rest
+        return table.sort_values('delta', kind='stable')
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_results(path:str, results:Union[dict,pd.DataFrame], subject:int, stage:str, mode:str, band:str='') -> int:
+    """Stores results in the store at 'path' with a connection of its own, so it can run in a background writer thread."""
+    with ResultsStore(path) as store:
+        return store.write(results, subject, stage, mode, band)
+
+def store_results(path:str, results:Union[dict,pd.DataFrame], subject:int, stage:str, mode:str, band:str='', writer=None) -> None:
+    """'write_results' now, or in the background when a writer (see 'prefetch.AsyncWriter') is given."""
+    frame = pd.DataFrame(results)
+    if writer is None:
+        write_results(path, frame, subject, stage, mode, band)
+    else:
+        writer.submit(write_results, path, frame, subject, stage, mode, band)
+
+def result_files(results_folder:str):
+    """(path, subject, stage, mode, band) of every original-data results CSV of the PID scripts under 'results_folder'."""
+    for folder, _, files in os.walk(results_folder):
+        for name in sorted(files):
+            for pattern, mode in FILE_PATTERNS:
+                match = pattern.match(name)
+                if match:
+                    fields = match.groupdict()
+                    yield os.path.join(folder, name), int(fields['subject']), fields['stage'], fields.get('mode') or mode, fields.get('band') or ''
+                    break
+
+def ingest(store:ResultsStore, results_folder:str) -> int:
+    """Stores every results CSV found under 'results_folder'. Returns the number of files stored."""
+    stored = 0
+    for path, subject, stage, mode, band in result_files(results_folder):
+        frame = pd.read_csv(path, index_col=0, float_precision='round_trip')
+        if 'target' in frame.columns:      # O-information tables have no triplet rows
+            store.write(frame, subject, stage, mode, band)
+            stored += 1
+    return stored
+
+def main():
+    _, rslts_folder = get_file_paths_from_config()
+    parser = argparse.ArgumentParser(description='Imports the PID results CSVs of a results folder into an indexed SQLite store')
+    parser.add_argument('-resultsfolder', default=rslts_folder, help='path of the PID analysis results')
+    parser.add_argument('-store',         default=None, help='path of the SQLite store, results.sqlite in the results folder if not given')
+    args  = parser.parse_args()
+
+    start = time.time()
+    with ResultsStore(args.store or os.path.join(args.resultsfolder, 'results.sqlite')) as store:
+        stored = ingest(store, args.resultsfolder)
+    print('Stored', stored, 'result files in', (time.time()-start), 's')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import os
+import glob
+import time
+import argparse
+import numpy  as np
+import pandas as pd
+from scipy.stats import false_discovery_control
+from typing      import Callable
+from result_sink import CHANNEL_KEYS, iter_batches
+from pid_metrics import stage
+
+# PID atoms tested against the surrogates by default
+ATOMS = ('sinergy', 'unique1', 'unique2', 'redundancy')
+
+class SurrogateSignificance:
+    """
+    Online surrogate test of the PID atoms of every (source1, source2, target) row of the original-data results, or every
+    (source1, source2, source3, target) row of quadruplet results. Surrogate results are consumed as they are produced
+    (whole surrogates or blocks of triplets, in any row order) and only a counter of surrogate values at least as extreme as
+    the original one, and the number of surrogate values seen, are kept per row and atom, so memory does not grow with the
+    number of surrogates. With 'sketch' > 0 a uniform reservoir sample of that many surrogate values per row and atom is
+    also kept, to estimate null quantiles.
+    """
+    def __init__(self, observed:pd.DataFrame, atoms:tuple=ATOMS, tail:str='greater', sketch:int=0, seed:int=None):
+        if tail not in ('greater', 'less', 'two-sided'):
+            raise ValueError('unknown tail ' + str(tail))
+        self.channels = [key for key in CHANNEL_KEYS if key in observed.columns]     # (source1, source2, target) for triplets
+        observed      = observed.drop_duplicates(subset=self.channels)                # e.g. the midline triplet, in both hemispheres
+        self.atoms    = list(atoms)
+        self.tail     = tail
+        self.keys     = observed[self.channels].astype(str).reset_index(drop=True)
+        self.rows     = {key:row for row,key in enumerate(zip(*(self.keys[column] for column in self.channels)))}
+        self.observed = observed[self.atoms].to_numpy(dtype=np.float64)
+        self.count    = np.zeros(self.observed.shape, dtype=np.int64)
+        self.seen     = np.zeros(len(self.observed), dtype=np.int64)
+        self.last     = np.full(len(self.observed), -1, dtype=np.int64)     # last surrogate counted in every row
+        self.batches  = 0
+        self.sketch   = sketch
+        self.rng      = np.random.default_rng(seed)
+        self.sample   = np.full(self.observed.shape + (sketch,), np.nan) if sketch > 0 else None
+
+    def _exceeds(self, values:np.ndarray, observed:np.ndarray) -> np.ndarray:
+        if self.tail == 'greater':
+            return values >= observed
+        if self.tail == 'less':
+            return values <= observed
+        return np.abs(values) >= np.abs(observed)
+
+    def update(self, results, surrogate:int=None) -> None:
+        """
+        Adds the rows of one batch of surrogate results, a data frame or dictionary of lists with the channel columns and
+        the atoms. Rows are counted once per surrogate: the surrogate index is 'surrogate', else the 'surrogate' column of
+        the results, else every batch is taken as a new surrogate. Every row must be a row of the original data.
+        """
+        results = pd.DataFrame(results, copy=False) if isinstance(results, dict) else results
+        if surrogate is None:
+            surrogate = results['surrogate'].to_numpy() if 'surrogate' in results else -2 - self.batches
+        self.batches += 1
+        rows    = np.fromiter((self.rows[key] for key in zip(*(results[column].astype(str) for column in self.channels))),
+                              dtype=np.intp, count=len(results))
+        ids     = np.broadcast_to(np.asarray(surrogate, dtype=np.int64), rows.shape)
+        _, kept = np.unique(rows, return_index=True)
+        kept    = kept[self.last[rows[kept]] != ids[kept]]
+        rows    = rows[kept]
+        values  = results[self.atoms].to_numpy(dtype=np.float64)[kept]
+        self.last[rows] = ids[kept]
+        self.count[rows] += self._exceeds(values, self.observed[rows])
+        self.seen[rows]  += 1
+        if self.sample is not None:
+            self._reservoir(rows, values)
+
+    def update_aligned(self, values:np.ndarray) -> None:
+        """
+        Adds whole surrogates given as an array of shape (n_surrogates, rows, atoms), with the rows in the order of the
+        original-data results, e.g. the null draws of 'pid_auxiliaries.analytical_surrogate_pid'. Not to be mixed with
+        'update' in the same test, since all rows are assumed to have seen the same surrogates.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.count   += self._exceeds(values, self.observed).sum(axis=0)
+        self.batches += len(values)
+        if self.sample is None:
+            self.seen += len(values)
+            return
+        for surrogate_values in values:
+            self.seen += 1
+            self._reservoir_aligned(surrogate_values)
+
+    def _reservoir_aligned(self, values:np.ndarray) -> None:
+        seen = self.seen[0]
+        if seen <= self.sketch:
+            self.sample[:,:,seen-1] = values
+        else:
+            slots = self.rng.integers(0, seen, size=values.shape)
+            kept  = np.nonzero(slots < self.sketch)
+            self.sample[kept + (slots[kept],)] = values[kept]
+
+    def _reservoir(self, rows:np.ndarray, values:np.ndarray) -> None:
+        # Algorithm R: the i-th value of a row (1-based) replaces a random slot with probability sketch/i
+        for row, row_values in zip(rows, values):
+            seen = self.seen[row]
+            if seen <= self.sketch:
+                self.sample[row,:,seen-1] = row_values
+            else:
+                slots = self.rng.integers(0, seen, size=len(self.atoms))
+                kept  = slots < self.sketch
+                self.sample[row, np.flatnonzero(kept), slots[kept]] = row_values[kept]
+
+    def consume(self, batches) -> 'SurrogateSignificance':
+        """Updates the counters with every batch of an iterable of surrogate results."""
+        for batch in batches:
+            self.update(batch)
+        return self
+
+    def p_values(self) -> np.ndarray:
+        """
+        Permutation p-values (1 + exceedances)/(1 + surrogates) of shape (rows, atoms), NaN for rows without surrogates.
+        """
+        with np.errstate(invalid='ignore'):
+            return np.where(self.seen[:,np.newaxis] > 0, (1 + self.count)/(1 + self.seen[:,np.newaxis]), np.nan)
+
+    def quantiles(self, q:float) -> np.ndarray:
+        """Quantile q of the surrogate values of every row and atom, estimated from the reservoir sample."""
+        if self.sample is None:
+            raise ValueError('quantiles need a reservoir sample, create the test with sketch > 0')
+        return np.nanquantile(self.sample, q, axis=-1)
+
+    def table(self, alpha:float=0.05, method:str='bh', quantile:float=None) -> pd.DataFrame:
+        """
+        Results of the test as a data frame with one row per original-data row: the channel columns, the number of
+        surrogates, and per atom its original value, p-value, FDR-adjusted p-value and significance mask at level 'alpha'.
+        The FDR correction ('bh' Benjamini-Hochberg or 'by' Benjamini-Yekutieli) is applied over all the rows of each atom.
+        With 'quantile' and a reservoir sample, the estimated null quantile of every atom is added as well.
+        """
+        p_values = self.p_values()
+        table    = self.keys.copy()
+        table['surrogates'] = self.seen
+        for column, atom in enumerate(self.atoms):
+            tested   = ~np.isnan(p_values[:,column])
+            adjusted = np.full(len(p_values), np.nan)
+            if tested.any():
+                adjusted[tested] = false_discovery_control(p_values[tested,column], method=method)
+            table[atom]                  = self.observed[:,column]
+            table[atom + '_p']           = p_values[:,column]
+            table[atom + '_p_fdr']       = adjusted
+            table[atom + '_significant'] = adjusted <= alpha
+            if quantile is not None:
+                table[atom + '_q' + str(quantile)] = self.quantiles(quantile)[:,column]
+        return table
+
+class SequentialSurrogateTest(SurrogateSignificance):
+    """
+    Sequential Monte Carlo (Besag-Clifford) version of the surrogate test: every row and atom receives surrogates until
+    'stop_count' surrogate values at least as extreme as the original one have been seen, or 'n_max' surrogates in total.
+    The p-value is stop_count/L for an atom stopped after L < n_max surrogates and (1 + exceedances)/(1 + n_max) otherwise,
+    which is a valid p-value: an atom reaching stop_count only at the last surrogate gets the p-value of the full test. The default stop_count = floor(alpha*(n_max + 1)) is the smallest count at which the decision at level
+    'alpha' of the full test with n_max surrogates is settled as non-significant, so clearly null rows stop after a few
+    surrogates while the decisions at 'alpha' are those of the full test. A triplet needs more surrogates as long as any of
+    its rows is undecided (see 'active_triplets').
+    """
+    def __init__(self, observed:pd.DataFrame, n_max:int, alpha:float=0.05, stop_count:int=None, atoms:tuple=ATOMS,
+                 tail:str='greater'):
+        super().__init__(observed, atoms, tail)
+        self.n_max      = n_max
+        if stop_count is None:
+            stop_count = max(1, int(np.floor(alpha*(n_max + 1))))
+        elif stop_count < 1:
+            raise ValueError('stop_count must be at least 1, not ' + str(stop_count))
+        self.stop_count = stop_count
+        self.stopped_at = np.zeros(self.observed.shape, dtype=np.int64)     # L of the stopped atoms, 0 while running
+        self.triplets   = {}
+        for row, key in enumerate(self.rows):
+            self.triplets.setdefault(frozenset(key), []).append(row)
+
+    def update(self, results, surrogate:int=None) -> None:
+        count   = self.count.copy()
+        super().update(results, surrogate)
+        running = self.stopped_at == 0
+        self.count      = np.where(running, self.count, count)
+        stopped         = running & (self.count >= self.stop_count)
+        self.stopped_at = np.where(stopped, self.seen[:,np.newaxis], self.stopped_at)
+
+    def settled(self) -> np.ndarray:
+        """Rows that need no more surrogates: all their atoms stopped, or n_max surrogates seen."""
+        return (self.stopped_at > 0).all(axis=1) | (self.seen >= self.n_max)
+
+    def active_triplets(self, triplets:list) -> list:
+        """Triplets of channel names with at least one row still undecided, each triplet once."""
+        settled = self.settled()
+        active  = {}
+        for triplet in triplets:
+            rows = self.triplets[frozenset(triplet)]
+            if not settled[rows].all():
+                active.setdefault(frozenset(triplet), triplet)
+        return list(active.values())
+
+    def p_values(self) -> np.ndarray:
+        full  = super().p_values()
+        early = (self.stopped_at > 0) & (self.stopped_at < self.n_max)
+        return np.where(early, self.stop_count/np.maximum(self.stopped_at, 1), full)
+
+def run_sequential_surrogates(analyze:Callable, surrogates, triplets:list, keys:list, test:SequentialSurrogateTest) -> int:
+    """
+    Draws surrogates 0,1,... until every row of the test is settled or test.n_max surrogates are drawn, computing the PID of
+    each surrogate only for the triplets still undecided.
+    Parameters:
+        analyze: function with signature (data, triplets, results) that appends the PID rows of a list of triplets.
+        surrogates: CholeskySurrogates of the recording.
+        triplets: list of triplets of channel names.
+        keys: columns of the results.
+        test: sequential test over the original-data results of the triplets.
+    Returns:
+        number of triplet PIDs computed.
+    """
+    computed = 0
+    for n in range(test.n_max):
+        active = test.active_triplets(triplets)
+        if not active:
+            break
+        print("\nCurrently processing surrogate #"+str(n), "-", len(active), "triplets undecided")
+        with stage('surrogate', surrogate=n):
+            data = surrogates.frame(surrogates.surrogate(n))
+        results = {key:[] for key in keys}
+        analyze(data, active, results)
+        test.update(results, n)
+        computed += len(active)
+    return computed
+
+def surrogate_batches(path:str):
+    """
+    Lazily yields the surrogate results stored at 'path': the record batches of an Arrow file written by ResultSink
+    (original-data rows, with surrogate index -1, are skipped), or the data frames of the CSV files matching a glob pattern.
+    """
+    if path.endswith('.arrow'):
+        for batch in iter_batches(path):
+            frame = batch.to_pandas()
+            yield frame[frame['surrogate'] >= 0]
+    else:
+        for csv_path in sorted(glob.glob(path)):
+            yield pd.read_csv(csv_path, float_precision='round_trip')
+
+def main():
+    parser = argparse.ArgumentParser(description='Surrogate significance of the PID atoms of a subject, streaming the surrogates')
+    parser.add_argument('observed',   help='CSV file with the PID of the original data')
+    parser.add_argument('surrogates', help='Arrow file of surrogate results, or glob pattern of surrogate CSV files (quoted)')
+    parser.add_argument('-output',    default=None, help='CSV file for the test results, <observed>_significance.csv by default')
+    parser.add_argument('-alpha',     type=float, default=0.05, help='FDR level')
+    parser.add_argument('-fdr',       default='bh', help='FDR correction over the triplets of each atom',choices=['bh','by'])
+    parser.add_argument('-tail',      default='greater', help='alternative hypothesis',choices=['greater','less','two-sided'])
+    parser.add_argument('-sketch',    type=int, default=0, help='surrogate values kept per row and atom to estimate null quantiles')
+    parser.add_argument('-quantile',  type=float, default=0.95, help='null quantile reported when -sketch is given')
+    args = parser.parse_args()
+
+    start    = time.time()
+    observed = pd.read_csv(args.observed, index_col=0, float_precision='round_trip')
+    test     = SurrogateSignificance(observed, tail=args.tail, sketch=args.sketch).consume(surrogate_batches(args.surrogates))
+    output   = args.output or os.path.splitext(args.observed)[0] + '_significance.csv'
+    test.table(args.alpha, args.fdr, args.quantile if args.sketch > 0 else None).to_csv(output)
+    print("Surrogates per row:", test.seen.min(), "-", test.seen.max())
+    print("ELAPSED TIME:",(time.time()-start)/60)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import numpy  as np
+import pandas as pd
+from typing       import Iterator
+from scipy.linalg import cholesky
+from recording    import Recording, channel_matrix
+
+class CholeskySurrogates:
+    """
+    Gaussian Cholesky surrogates of a recording: independent standard normal series mixed by the Cholesky factor of the
+    sample correlation matrix of the EEG channels. The factor is computed once per recording, and surrogate number n is
+    always drawn from its own random stream spawned from the seed, so any surrogate can be reproduced in isolation.
+    """
+    def __init__(self, data_df:pd.DataFrame, seed:int=None):
+        series             = channel_matrix(data_df)
+        self.columns       = list(data_df.columns)
+        self.recording     = isinstance(data_df, Recording)
+        self.dtype         = series.dtype
+        self.shape         = series.shape
+        self.factor        = cholesky(np.corrcoef(series), lower=True)
+        self.seed_sequence = np.random.SeedSequence(seed)
+
+    @property
+    def seed(self) -> int:
+        """Entropy of the root seed, enough to reproduce every surrogate stream."""
+        return self.seed_sequence.entropy
+
+    def rng(self, index:int) -> np.random.Generator:
+        return np.random.default_rng(np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=(index,)))
+
+    def surrogate(self, index:int) -> np.ndarray:
+        """
+        Surrogate number 'index' as an array of shape (channels, samples).
+        """
+        return self.factor @ self.rng(index).standard_normal(self.shape)
+
+    def batch(self, start:int, size:int) -> np.ndarray:
+        """
+        Surrogates number start,...,start+size-1 as an array of shape (size, channels, samples).
+        """
+        noise = np.empty((size,)+self.shape)
+        for n in range(size):
+            self.rng(start+n).standard_normal(out=noise[n])
+        return np.matmul(self.factor, noise, out=noise)
+
+    def generate(self, n_surrogates:int, start:int=0, batch_size:int=16) -> Iterator[np.ndarray]:
+        """
+        Lazily yields surrogates start,...,start+n_surrogates-1, drawn in batches of at most 'batch_size'.
+        """
+        stop = start + n_surrogates
+        for batch_start in range(start, stop, batch_size):
+            yield from self.batch(batch_start, min(batch_size, stop-batch_start))
+
+    def correlations(self, start:int, size:int) -> np.ndarray:
+        """
+        Sample correlation matrices of 'size' surrogates drawn directly, without generating any time series: the scatter
+        matrix of a surrogate is Wishart distributed with the correlation of the recording as scale and n_samples-1 degrees
+        of freedom, and is sampled with the Bartlett decomposition (chi-square diagonal, normal lower triangle) mixed by the
+        Cholesky factor. Matrix number n has its own random stream, like surrogate n, but is not the correlation of
+        'surrogate(n)': only its distribution is the same.
+        Returns:
+            array of shape (size, channels, channels).
+        """
+        n_channels = self.shape[0]
+        df         = self.shape[1] - 1
+        lower      = np.tril_indices(n_channels, -1)
+        bartlett   = np.zeros((size, n_channels, n_channels))
+        for n in range(size):
+            rng = self.rng(start+n)
+            bartlett[n][np.diag_indices(n_channels)] = np.sqrt(rng.chisquare(df - np.arange(n_channels)))
+            bartlett[n][lower]                       = rng.standard_normal(len(lower[0]))
+        mixed   = np.matmul(self.factor, bartlett, out=bartlett)
+        scatter = mixed @ np.swapaxes(mixed, 1, 2)
+        scale   = np.sqrt(np.diagonal(scatter, axis1=1, axis2=2))
+        return scatter/(scale[:,:,np.newaxis]*scale[:,np.newaxis,:])
+
+    def frame(self, surrogate:np.ndarray) -> pd.DataFrame:
+        """
+        Wraps a surrogate like the original data: a Recording of the same dtype, or a data frame (without copies).
+        """
+        if self.recording:
+            return Recording(surrogate.astype(self.dtype, copy=False), self.columns)
+        return pd.DataFrame(surrogate.T, columns=self.columns, copy=False)
+
+    def frames(self, n_surrogates:int, start:int=0, batch_size:int=16) -> Iterator[pd.DataFrame]:
+        """
+        Same as 'generate', with every surrogate wrapped as the original data (see 'frame').
+        """
+        for surrogate in self.generate(n_surrogates, start, batch_size):
+            yield self.frame(surrogate)
@@ -0,0 +1,33 @@
+import pytest
+import numpy  as np
+import pandas as pd
+from significance import SequentialSurrogateTest
+
+def observed_rows() -> pd.DataFrame:
+    return pd.DataFrame({'source1':['a'], 'source2':['b'], 'target':['c'], 'sinergy':[1.0], 'redundancy':[1.0]})
+
+def surrogate_rows(value:float) -> dict:
+    return {'source1':['a'], 'source2':['b'], 'target':['c'], 'sinergy':[value], 'redundancy':[0.0]}
+
+def test_stop_at_n_max_gets_full_test_p_value():
+    # the 50th exceedance arrives with the last of 1000 surrogates: p = 51/1001 > alpha, as in the full test
+    n_max, alpha = 1000, 0.05
+    test         = SequentialSurrogateTest(observed_rows(), n_max, alpha, atoms=('sinergy','redundancy'))
+    assert test.stop_count == 50
+    for n in range(n_max):
+        test.update(surrogate_rows(2.0 if n >= n_max - test.stop_count else 0.0), n)
+    assert test.stopped_at[0,0] == n_max
+    p_value = test.p_values()[0,0]
+    assert p_value == (1 + 50)/(1 + n_max)
+    assert p_value > alpha
+
+def test_early_stop_p_value():
+    test = SequentialSurrogateTest(observed_rows(), 1000, 0.05, atoms=('sinergy','redundancy'))
+    for n in range(test.stop_count):
+        test.update(surrogate_rows(2.0), n)
+    assert test.stopped_at[0,0] == test.stop_count
+    assert test.p_values()[0,0] == 1.0
+
+def test_stop_count_must_be_positive():
+    with pytest.raises(ValueError):
+        SequentialSurrogateTest(observed_rows(), 1000, 0.05, stop_count=0, atoms=('sinergy','redundancy'))
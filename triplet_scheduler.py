@@ -0,0 +1,130 @@
+import time
+import numpy  as np
+import pandas as pd
+import pid_metrics
+from typing          import Callable, Dict
+from tqdm            import tqdm
+from multiprocessing import Pool, shared_memory
+from recording       import Recording
+
+# per-worker view of the channels data, attached to the shared memory block of the parent process on the first task
+_worker_data   = None
+_worker_memory = None
+_worker_layout = None
+
+def _start_worker() -> None:
+    pid_metrics.detach()
+
+def _attach_shared_data(memory_name:str, shape:tuple, dtype:str, columns:list, recording:bool) -> None:
+    global _worker_data, _worker_memory, _worker_layout
+    if _worker_layout == (memory_name, shape, dtype, columns, recording):
+        return
+    if _worker_memory is not None and _worker_memory.name != memory_name:
+        _worker_memory.close()
+        _worker_memory = None
+    if _worker_memory is None:
+        _worker_memory = shared_memory.SharedMemory(name=memory_name)
+    array          = np.ndarray(shape, dtype=dtype, buffer=_worker_memory.buf)
+    _worker_data   = Recording(array, columns) if recording else pd.DataFrame(array, columns=columns, copy=False)
+    _worker_layout = (memory_name, shape, dtype, columns, recording)
+
+def _run_chunk(task:tuple) -> tuple:
+    rows_function, triplets, keys, shared = task
+    _attach_shared_data(*shared)
+    results = {key:[] for key in keys}
+    start   = time.perf_counter()
+    rows_function(_worker_data, triplets, results)
+    return results, time.perf_counter() - start
+
+class TripletPool:
+    """
+    Worker processes and the shared memory block of the channels data, kept for several 'run_triplets' calls, e.g. every
+    block of every surrogate of a run, so the pool is started once. Each call copies its data into the block, which is only
+    reallocated when the size of the data changes, and workers attach to it again on their next task when it has changed.
+    The workers are started with the first block, so they share the resource tracker of this process and never unlink it.
+    Use it as a context manager; with workers <= 1 it holds nothing and 'run_triplets' runs serially.
+    """
+    def __init__(self, workers:int):
+        self.workers = workers
+        self.pool    = None
+        self.memory  = None
+
+    def share(self, data:pd.DataFrame) -> tuple:
+        """Copies the channels data into shared memory and returns the arguments workers attach to it with."""
+        recording = isinstance(data, Recording)
+        array     = data.data if recording else np.ascontiguousarray(data.to_numpy())
+        if self.memory is None or self.memory.size < max(1, array.nbytes):
+            self._release()
+            self.memory = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=self.memory.buf)[:] = array
+        if self.pool is None:
+            self.pool = Pool(self.workers, initializer=_start_worker)
+        return (self.memory.name, array.shape, array.dtype.str, list(data.columns), recording)
+
+    def _release(self) -> None:
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def close(self) -> None:
+        try:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+        finally:
+            self._release()
+
+    def __enter__(self) -> 'TripletPool':
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is not None and self.pool is not None:
+            self.pool.terminate()
+        self.close()
+
+def chunk_triplets(triplets:list, chunksize:int) -> list:
+    return [triplets[i:i+chunksize] for i in range(0, len(triplets), chunksize)]
+
+def run_triplets(rows_function:Callable, data:pd.DataFrame, triplets:list, results:Dict[str,list], workers:int=1, chunksize:int=1,
+                 pool:TripletPool=None) -> None:
+    """
+    Applies a PID rows function to chunks of triplets, either serially or over a pool of worker processes.
+    The channels data is copied once into shared memory and attached by every worker, so only triplet names are pickled per task.
+    Rows are appended to 'results' in the same order as the serial path.
+    Parameters:
+        rows_function: function with signature (data, triplets, results) that appends the PID rows of a list of triplets,
+                       e.g. 'pid_rows' or 'pid_rows_continuous'. Must be importable from a module for the worker processes.
+        data: data frame or Recording with the EEG channels data.
+        triplets: list of triplets of channel names.
+        results: dictionary of lists where the rows are appended.
+        workers: number of worker processes, 1 runs everything in the current process.
+        chunksize: number of triplets sent to a worker in each task.
+        pool: TripletPool reused across calls, whose workers replace 'workers'; a pool is started for this call if None.
+    """
+    workers = pool.workers if pool is not None else workers
+    chunks  = chunk_triplets(triplets, chunksize)
+    seconds = []
+    with pid_metrics.stage('pid', triplets=len(triplets), workers=workers, chunksize=chunksize):
+        if workers <= 1:
+            for chunk in tqdm(chunks):
+                start = time.perf_counter()
+                rows_function(data, chunk, results)
+                seconds.append(time.perf_counter() - start)
+        elif pool is None:
+            with TripletPool(workers) as pool:
+                _run_pool(pool, rows_function, data, chunks, results, seconds)
+        else:
+            _run_pool(pool, rows_function, data, chunks, results, seconds)
+    if pid_metrics.active() is not None:
+        pid_metrics.active().chunk_times(rows_function, data, chunks, seconds)
+    return
+
+def _run_pool(pool:TripletPool, rows_function:Callable, data:pd.DataFrame, chunks:list, results:Dict[str,list], seconds:list) -> None:
+    shared = pool.share(data)
+    tasks  = [(rows_function, chunk, list(results.keys()), shared) for chunk in chunks]
+    for chunk_results, chunk_seconds in tqdm(pool.pool.imap(_run_chunk, tasks), total=len(tasks)):
+        for key in results:
+            results[key].extend(chunk_results[key])
+        seconds.append(chunk_seconds)
+    return